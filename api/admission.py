@@ -0,0 +1,93 @@
+"""
+Contrôle d'admission des requêtes de génération
+
+Chaque processus suit le travail amont qu'il a accepté (appels LLM en cours ou
+en attente). Au-delà de la capacité configurée, les nouvelles requêtes sont
+refusées tôt (503 + Retry-After) pour que celles déjà acceptées aboutissent.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+logger = logging.getLogger('api')
+
+
+class ServiceOverloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Service saturé, réessayez plus tard."
+    default_code = 'overloaded'
+
+    def __init__(self, wait, detail=None):
+        super().__init__(detail)
+        # Repris par le gestionnaire d'exceptions DRF dans l'en-tête Retry-After
+        self.wait = wait
+
+
+class AdmissionController:
+    """Compteurs thread-safe du travail amont accepté par ce processus"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reserved = 0
+        self.inflight = 0
+
+    @property
+    def capacity(self):
+        return settings.ADMISSION_CAPACITY
+
+    def try_reserve(self, cost):
+        """Réserve `cost` appels amont ; retourne la part réservée, ou None si saturé"""
+        # Une requête seule plus grosse que la capacité reste admissible quand le processus est libre
+        cost = max(1, min(cost, self.capacity))
+        with self._lock:
+            if self.reserved + cost > self.capacity:
+                return None
+            self.reserved += cost
+            return cost
+
+    def release(self, cost):
+        with self._lock:
+            self.reserved = max(0, self.reserved - cost)
+
+    @contextmanager
+    def admit(self, cost):
+        """Réserve le travail d'une requête pour toute sa durée ou lève ServiceOverloaded"""
+        reserved = self.try_reserve(cost)
+        if reserved is None:
+            snapshot = self.snapshot()
+            logger.warning(
+                "Admission refused (cost %s, reserved %s, in flight %s, capacity %s)",
+                cost, snapshot['reserved'], snapshot['inflight'], snapshot['capacity'],
+            )
+            raise ServiceOverloaded(wait=settings.ADMISSION_RETRY_AFTER)
+        try:
+            yield reserved
+        finally:
+            self.release(reserved)
+
+    @contextmanager
+    def upstream_call(self):
+        """Compte un appel LLM en cours"""
+        with self._lock:
+            self.inflight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.inflight -= 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'capacity': self.capacity,
+                'reserved': self.reserved,
+                'inflight': self.inflight,
+                'queued': max(0, self.reserved - self.inflight),
+            }
+
+
+admission = AdmissionController()
@@ -0,0 +1,77 @@
+"""
+Budgets de longueur de sortie adaptatifs
+
+Les tailles réelles des contenus générés sont observées par type de jeu, tranche
+d'âge et difficulté. La limite de tokens d'un groupe est un centile élevé de ces
+observations, plus une marge. Tant qu'un groupe a trop peu d'observations, une
+valeur par défaut par type de jeu est utilisée.
+"""
+import math
+import threading
+from collections import deque
+
+from django.conf import settings
+
+# Limites initiales (tokens) avant d'avoir assez d'observations
+DEFAULT_BUDGETS = {
+    'quiz': 1200,
+    'wordgame': 800,
+    'puzzle': 900,
+    'story': 1500,
+    'treasure': 1000,
+    'memory': 700,
+}
+DEFAULT_BUDGET = 1000
+
+AGE_BANDS = ((3, 5), (6, 8), (9, 11), (12, 14), (15, 18))
+
+SAMPLES_PER_BUCKET = 200
+
+
+def estimate_tokens(text):
+    """Estimation grossière (environ 4 caractères par token)"""
+    return len(text) // 4 + 1
+
+
+def age_band(age):
+    for low, high in AGE_BANDS:
+        if low <= age <= high:
+            return f"{low}-{high}"
+    return str(age)
+
+
+class OutputBudgets:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    @staticmethod
+    def bucket(game_type, age, difficulty):
+        return (game_type, age_band(age) if isinstance(age, int) else str(age), difficulty)
+
+    def observe(self, game_type, age, difficulty, content):
+        """Enregistre la taille d'une sortie complète (non tronquée)"""
+        key = self.bucket(game_type, age, difficulty)
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=SAMPLES_PER_BUCKET)).append(estimate_tokens(content))
+
+    def limit(self, game_type, age, difficulty):
+        """Limite de tokens de sortie pour ce groupe, ou None si les budgets sont désactivés"""
+        if not settings.OUTPUT_BUDGET_ENABLED:
+            return None
+        with self._lock:
+            samples = sorted(self._samples.get(self.bucket(game_type, age, difficulty), ()))
+        if len(samples) < settings.OUTPUT_BUDGET_MIN_SAMPLES:
+            budget = DEFAULT_BUDGETS.get(game_type, DEFAULT_BUDGET)
+        else:
+            # Centile par rang le plus proche
+            rank = math.ceil(settings.OUTPUT_BUDGET_PERCENTILE / 100 * len(samples)) - 1
+            budget = math.ceil(samples[max(rank, 0)] * settings.OUTPUT_BUDGET_HEADROOM)
+        return min(budget, settings.OUTPUT_BUDGET_MAX_TOKENS)
+
+    def snapshot(self):
+        with self._lock:
+            return {'/'.join(map(str, key)): len(samples) for key, samples in self._samples.items()}
+
+
+output_budgets = OutputBudgets()
@@ -0,0 +1,126 @@
+"""
+Enregistrement / rejeu des appels fournisseurs (tests de charge hors-ligne)
+
+En mode `record`, chaque réponse réelle est ajoutée à une cassette JSONL par
+fournisseur, indexée par le hash du prompt normalisé. En mode `replay`, les
+réponses sont servies depuis la cassette avec la latence d'origine (ajustable).
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from pathlib import Path
+
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger('api')
+
+
+def normalize_prompt(prompt):
+    return re.sub(r'\s+', ' ', prompt).strip().lower()
+
+
+def prompt_key(prompt):
+    return hashlib.sha256(normalize_prompt(prompt).encode()).hexdigest()[:32]
+
+
+def prompt_shape(prompt):
+    """Hash du prompt sans ses nombres : sert de repli quand le prompt exact n'a pas été enregistré"""
+    return hashlib.sha256(re.sub(r'\d+', '#', normalize_prompt(prompt)).encode()).hexdigest()[:32]
+
+
+class CassetteStore:
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+        self._loaded = {}
+
+    def _path(self, provider):
+        return self.directory / f"{provider}.jsonl"
+
+    def _index(self, provider):
+        """Index {clé: entrée} et {forme: [entrées]} d'un fournisseur, chargé une fois"""
+        with self._lock:
+            if provider not in self._loaded:
+                by_key, by_shape = {}, {}
+                path = self._path(provider)
+                if path.exists():
+                    with open(path, encoding='utf-8') as f:
+                        for line in f:
+                            if line.strip():
+                                self._add(by_key, by_shape, json.loads(line))
+                self._loaded[provider] = (by_key, by_shape)
+            return self._loaded[provider]
+
+    @staticmethod
+    def _add(by_key, by_shape, entry):
+        by_key[entry['key']] = entry
+        by_shape.setdefault(entry['shape'], []).append(entry)
+
+    def lookup(self, provider, prompt):
+        by_key, by_shape = self._index(provider)
+        key = prompt_key(prompt)
+        entry = by_key.get(key)
+        if entry is None:
+            candidates = by_shape.get(prompt_shape(prompt))
+            if candidates:
+                # Choix déterministe pour que le rejeu soit reproductible
+                entry = candidates[int(key, 16) % len(candidates)]
+        return entry
+
+    def record(self, provider, prompt, status_code, content, latency_ms, truncated=False, error=None):
+        entry = {
+            'key': prompt_key(prompt),
+            'shape': prompt_shape(prompt),
+            'status_code': status_code,
+            'content': content,
+            'truncated': truncated,
+            'latency_ms': latency_ms,
+            'error': error,
+        }
+        by_key, by_shape = self._index(provider)
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(self._path(provider), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self._add(by_key, by_shape, entry)
+
+
+_stores = {}
+
+
+def get_cassette_store():
+    """Store du mode courant, ou None si l'enregistrement/rejeu est désactivé"""
+    if settings.LLM_CASSETTE_MODE not in ('record', 'replay'):
+        return None
+    directory = settings.LLM_CASSETTE_DIR
+    if directory not in _stores:
+        _stores[directory] = CassetteStore(directory)
+    return _stores[directory]
+
+
+async def replay(store, config, prompt):
+    entry = store.lookup(config['name'], prompt)
+    if entry is None:
+        logger.warning("Cassette miss for %s", config['name'], extra={'provider': config['name']})
+        return 404, None, False
+    await asyncio.sleep(entry['latency_ms'] / 1000 * settings.LLM_CASSETTE_LATENCY_SCALE)
+    if entry.get('error') == 'timeout':
+        raise httpx.ReadTimeout("Replayed timeout")
+    return entry['status_code'], entry['content'], entry.get('truncated', False)
+
+
+async def record(store, config, prompt, call):
+    """Exécute l'appel réel `call()` et enregistre sa réponse (ou son timeout)"""
+    started = time.perf_counter()
+    try:
+        status_code, content, truncated = await call()
+    except httpx.TimeoutException:
+        store.record(config['name'], prompt, None, None, round((time.perf_counter() - started) * 1000, 1), error='timeout')
+        raise
+    store.record(config['name'], prompt, status_code, content, round((time.perf_counter() - started) * 1000, 1), truncated=truncated)
+    return status_code, content, truncated
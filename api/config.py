@@ -4,18 +4,52 @@ Configuration centralisée pour les APIs LLM
 from django.conf import settings
 import logging
 
+from .local_provider import LOCAL_GAME_TYPES, local_provider_config
+from .prompt_cache import Prompt, cacheable_prefix, gemini_context_cache
+
 logger = logging.getLogger('api')
 
 # Types de jeux supportés
 GAME_TYPES = ['quiz', 'wordgame', 'puzzle', 'story', 'treasure', 'memory']
 
+def build_openrouter_body(prompt, max_tokens=None, cached_content=None):
+    prefix = cacheable_prefix(prompt)
+    if prefix:
+        # Préfixe stable en premier, marqué pour le cache de prompt du fournisseur
+        messages = [
+            {"role": "system", "content": [{"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}}]},
+            {"role": "user", "content": prompt.body},
+        ]
+    else:
+        messages = [{"role": "user", "content": str(prompt)}]
+    body = {"model": "moonshotai/kimi-dev-72b:free", "messages": messages}
+    if max_tokens:
+        body["max_tokens"] = max_tokens
+    return body
+
+def build_gemini_body(prompt, max_tokens=None, cached_content=None):
+    prefix = cacheable_prefix(prompt)
+    if prefix:
+        body = {"contents": [{"role": "user", "parts": [{"text": prompt.body}]}]}
+        if cached_content:
+            body["cachedContent"] = cached_content
+        else:
+            body["systemInstruction"] = {"parts": [{"text": prefix}]}
+    else:
+        body = {"contents": [{"parts": [{"text": str(prompt)}]}]}
+    if max_tokens:
+        body["generationConfig"] = {"maxOutputTokens": max_tokens}
+    return body
+
 # Configuration des LLM avec clés sécurisées
 def get_llm_configs():
     """Retourne la configuration des LLM avec les clés depuis les variables d'environnement"""
     configs = []
+    # En rejeu de cassettes, les fournisseurs sont simulés : aucune clé n'est nécessaire
+    replaying = settings.LLM_CASSETTE_MODE == 'replay'
     
     # OpenRouter
-    if settings.OPENROUTER_API_KEY:
+    if settings.OPENROUTER_API_KEY or replaying:
         configs.append({
             'name': 'openrouter',
             'url': 'https://openrouter.ai/api/v1/chat/completions',
@@ -26,24 +60,23 @@ def get_llm_configs():
                 'Content-Type': 'application/json; charset=utf-8'
             },
             'model': 'moonshotai/kimi-k2:free',
-            'body_builder': lambda prompt: {
-                "model": "moonshotai/kimi-dev-72b:free", 
-                "messages": [{"role": "user", "content": prompt}]
-            },
+            'body_builder': build_openrouter_body,
             'extractor': lambda resp: resp.get('choices', [{}])[0].get('message', {}).get('content', None),
+            'truncated': lambda resp: resp.get('choices', [{}])[0].get('finish_reason') == 'length',
         })
     
     # Gemini
-    if settings.GEMINI_API_KEY:
+    if settings.GEMINI_API_KEY or replaying:
         configs.append({
             'name': 'gemini',
             'url': f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={settings.GEMINI_API_KEY}',
             'headers': {},
             'model': 'gemini-2.0-flash',
-            'body_builder': lambda prompt: {
-                "contents": [{"parts": [{"text": prompt}]}]
-            },
+            'cache_url': f'https://generativelanguage.googleapis.com/v1beta/cachedContents?key={settings.GEMINI_API_KEY}',
+            'context_cache': gemini_context_cache,
+            'body_builder': build_gemini_body,
             'extractor': lambda resp: resp.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', None),
+            'truncated': lambda resp: resp.get('candidates', [{}])[0].get('finishReason') == 'MAX_TOKENS',
         })
     
     if not configs:
@@ -51,47 +84,104 @@ def get_llm_configs():
     
     return configs
 
-# Prompts optimisés par type de jeu
+def get_provider_chain(llm_configs, game_type, level):
+    """
+    Ordonne les fournisseurs pour un jeu donné. Le fournisseur local passe en premier
+    pour les jeux simples des premiers niveaux, sinon il sert de dernier recours.
+    """
+    if not settings.LOCAL_PROVIDER_ENABLED or game_type not in LOCAL_GAME_TYPES:
+        return llm_configs
+    local = local_provider_config()
+    if isinstance(level, int) and level <= settings.LOCAL_PROVIDER_PRIMARY_MAX_LEVEL:
+        return [local] + llm_configs
+    return llm_configs + [local]
+
+# Préambule commun à tous les prompts de jeu (partie stable, mise en cache)
+GAME_PROMPT_PREAMBLE = """You are an expert game designer of biblical educational games for children.
+Content must be biblically accurate, age-appropriate, original and ready to use in the game.
+The parameters of the requested game (level, difficulty, age) are given at the end."""
+
+# Prompts optimisés par type de jeu (sans paramètres : ils restent identiques d'un appel à l'autre)
 GAME_PROMPTS = {
-    'quiz': """Generate a biblical multiple choice quiz with {questions} questions for level {level}.
-Difficulty: {difficulty}, age: {age} years.
+    'quiz': """Generate a biblical multiple choice quiz with the requested number of questions.
 Format: Question, 4 choices (A,B,C,D), correct answer.
 Biblical themes adapted to age. Be creative and educational.""",
     
-    'wordgame': """Create a biblical word game for level {level}.
-Difficulty: {difficulty}, age: {age} years.
+    'wordgame': """Create a biblical word game.
 Propose biblical words to guess with progressive clues.
 Adapt word complexity to age.""",
     
-    'puzzle': """Design a biblical puzzle for level {level}.
-Difficulty: {difficulty}, age: {age} years.
+    'puzzle': """Design a biblical puzzle.
 Can be image, word, or logic puzzle.
 Provide elements and solution.""",
     
-    'story': """Tell an interactive biblical story for level {level}.
-Difficulty: {difficulty}, age: {age} years.
+    'story': """Tell an interactive biblical story.
 Story with multiple choices and consequences.
 Adapt vocabulary and length to age.""",
     
-    'treasure': """Create a biblical treasure hunt for level {level}.
-Difficulty: {difficulty}, age: {age} years.
+    'treasure': """Create a biblical treasure hunt.
 Biblical clues leading to a "treasure" (verse, teaching).
 Logical and educational progression.""",
     
-    'memory': """Design a biblical memory game for level {level}.
-Difficulty: {difficulty}, age: {age} years.
+    'memory': """Design a biblical memory game.
 Pairs to match (characters/actions, verses/references, etc.).
 Adapt number of pairs to age and level."""
 }
 
+GAME_PROMPT_PARAMETERS = """Level: {level}
+Difficulty: {difficulty}
+Age: {age} years"""
+
 def get_game_prompt(game_type, level, age, difficulty, **kwargs):
-    """Generate an optimized prompt for a given game type"""
+    """Generate an optimized prompt for a given game type (stable prefix first, then parameters)"""
     if game_type not in GAME_PROMPTS:
-        return f"Generate biblical content of type {game_type} for level {level}, difficulty {difficulty}, age {age} years."
+        return Prompt(GAME_PROMPT_PREAMBLE, f"Generate biblical content of type {game_type}.\n" + GAME_PROMPT_PARAMETERS.format(
+            level=level, difficulty=difficulty, age=age,
+        ))
     
-    return GAME_PROMPTS[game_type].format(
-        level=level,
-        difficulty=difficulty,
-        age=age,
-        **kwargs
-    )
\ No newline at end of file
+    body = GAME_PROMPT_PARAMETERS.format(level=level, difficulty=difficulty, age=age)
+    if kwargs.get('questions'):
+        body += f"\nNumber of questions: {kwargs['questions']}"
+    return Prompt(f"{GAME_PROMPT_PREAMBLE}\n\n{GAME_PROMPTS[game_type]}", body)
+
+# Prompt de structure de progression : seuls l'âge et le nombre de niveaux varient
+STRUCTURE_PROMPT_PREAMBLE = (
+    "Tu es un game designer expert en jeux éducatifs bibliques pour enfants. "
+    f"Voici la liste des types de jeux disponibles : {', '.join(GAME_TYPES)}. "
+    "Génère une progression complète du nombre de niveaux demandé pour l'âge indiqué, "
+    "où chaque niveau contient une alternance variée et logique de jeux, avec difficulté, nombre de jeux, nombre de questions pour les quiz, etc. "
+    "Adapte la structure à l'âge, propose des niveaux équilibrés, ludiques et progressifs. "
+    "Pour chaque niveau, donne un JSON structuré : level, difficulty, games (liste ordonnée d'objets avec type, consigne, nombre de questions si quiz, etc.). "
+    "N'invente pas de nouveaux types de jeux. Ne mets pas de fallback. Ne donne que la structure, pas le contenu des jeux."
+)
+
+def get_structure_prompt(max_level, age):
+    return Prompt(STRUCTURE_PROMPT_PREAMBLE, f"L'utilisateur a {age} ans. Nombre de niveaux : {max_level}.")
+
+# Prompt de contenu d'un jeu décrit par la structure
+GAME_CONTENT_PROMPT_PREAMBLE = (
+    "Tu es un assistant IA pour un jeu éducatif biblique. Génère le contenu complet du jeu décrit ci-dessous. "
+    "Le contenu doit être original, adapté à l'âge, cohérent, et prêt à être utilisé dans le jeu. "
+    "Réponds uniquement par le contenu, sans explication."
+)
+
+GAME_CONTENT_FIELDS = (
+    ('instruction', "Consigne"),
+    ('consigne', "Consigne"),
+    ('number_of_questions', "Nombre de questions"),
+    ('nombre_de_questions', "Nombre de questions"),
+    ('word_length', "Longueur des mots"),
+    ('nombre_de_mots', "Nombre de mots"),
+    ('nombre_de_paires', "Nombre de paires"),
+    ('nombre_de_pièces', "Nombre de pièces"),
+    ('nombre_d_indices', "Nombre d'indices"),
+)
+
+def get_game_content_prompt(game, level, age, difficulty):
+    """Prompt contextuel pour un jeu de la structure générée"""
+    body = f"- Type de jeu : {game.get('type')}\n"
+    for field, label in GAME_CONTENT_FIELDS:
+        if field in game:
+            body += f"- {label} : {game[field]}\n"
+    body += f"- Niveau : {level}\n- Difficulté : {difficulty}\n- Âge utilisateur : {age}"
+    return Prompt(GAME_CONTENT_PROMPT_PREAMBLE, body)
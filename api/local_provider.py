@@ -0,0 +1,141 @@
+"""
+Fournisseur local : génère quiz, memory et wordgame à partir d'une banque
+biblique embarquée (api/data/bible_bank.json), sans appel réseau.
+"""
+import json
+import random
+from bisect import bisect_right
+from functools import lru_cache
+from pathlib import Path
+
+BANK_PATH = Path(__file__).resolve().parent / 'data' / 'bible_bank.json'
+
+LOCAL_GAME_TYPES = ('quiz', 'memory', 'wordgame')
+
+DIFFICULTIES = ('facile', 'normal', 'difficile')
+
+
+class AgeIndex:
+    """Éléments triés par âge minimum : ceux accessibles à un âge forment un préfixe"""
+
+    def __init__(self, items):
+        self.items = sorted(items, key=lambda item: item['min_age'])
+        self.ages = [item['min_age'] for item in self.items]
+
+    def upto(self, age):
+        return self.items[:bisect_right(self.ages, age)]
+
+
+class QuestionBank:
+    """Banque de questions, versets, paires et mots, indexée par difficulté et âge minimum"""
+
+    def __init__(self, data):
+        self.questions_by_difficulty = {
+            d: AgeIndex(q for q in data['questions'] if q['difficulty'] == d) for d in DIFFICULTIES
+        }
+        self.verses = AgeIndex(data['verses'])
+        self.pairs = AgeIndex(data['pairs'])
+        self.words = AgeIndex(data['words'])
+
+    def questions(self, difficulty, age):
+        """Questions de la difficulté demandée, complétées par les difficultés voisines"""
+        wanted = DIFFICULTIES.index(difficulty) if difficulty in DIFFICULTIES else 0
+        ordered = sorted(DIFFICULTIES, key=lambda d: abs(DIFFICULTIES.index(d) - wanted))
+        return [self.questions_by_difficulty[d].upto(age) for d in ordered]
+
+    def verses_for(self, age):
+        return self.verses.upto(age)
+
+    def pairs_for(self, age):
+        return self.pairs.upto(age)
+
+    def words_for(self, age):
+        return self.words.upto(age)
+
+
+@lru_cache(maxsize=1)
+def get_bank():
+    with open(BANK_PATH, encoding='utf-8') as f:
+        return QuestionBank(json.load(f))
+
+
+def _pick(pools, count, rng):
+    """Tire `count` éléments distincts en épuisant les pools dans l'ordre"""
+    picked = []
+    for pool in pools:
+        remaining = count - len(picked)
+        if remaining <= 0:
+            break
+        picked += rng.sample(pool, min(remaining, len(pool)))
+    return picked
+
+
+def generate_quiz(level, age, difficulty, questions=None, rng=random):
+    count = questions or min(3 + level, 8)
+    items = _pick(get_bank().questions(difficulty, age), count, rng)
+    if len(items) < count:
+        return None
+    lines = [f"Quiz biblique - niveau {level}"]
+    for number, item in enumerate(items, start=1):
+        order = list(range(len(item['choices'])))
+        rng.shuffle(order)
+        choices = ' '.join(f"{letter}) {item['choices'][i]}" for letter, i in zip('ABCD', order))
+        answer = 'ABCD'[order.index(item['answer'])]
+        lines.append(f"Question {number} : {item['question']}\n{choices}\nRéponse : {answer} ({item['reference']})")
+    return '\n\n'.join(lines)
+
+
+def generate_memory(level, age, difficulty, rng=random):
+    count = min(3 + level, 8)
+    bank = get_bank()
+    # Les plus jeunes associent personnages et objets, les plus grands versets et références
+    if age < 8:
+        items = [(p['left'], p['right']) for p in _pick([bank.pairs_for(age)], count, rng)]
+    else:
+        verses = _pick([bank.verses_for(age)], count // 2, rng)
+        pairs = _pick([bank.pairs_for(age)], count - len(verses), rng)
+        items = [(v['reference'], v['text']) for v in verses] + [(p['left'], p['right']) for p in pairs]
+    if len(items) < count:
+        return None
+    lines = [f"Jeu de mémoire - niveau {level} : associe chaque carte à sa paire."]
+    lines += [f"Paire {number} : {left} ↔ {right}" for number, (left, right) in enumerate(items, start=1)]
+    return '\n'.join(lines)
+
+
+def generate_wordgame(level, age, difficulty, rng=random):
+    count = min(2 + level, 6)
+    # Plus la difficulté est élevée, moins d'indices sont donnés
+    clue_count = {'facile': 3, 'normal': 2, 'difficile': 1}.get(difficulty, 2)
+    items = _pick([get_bank().words_for(age)], count, rng)
+    if len(items) < count:
+        return None
+    lines = [f"Jeu de mots biblique - niveau {level} : trouve le mot grâce aux indices."]
+    for number, item in enumerate(items, start=1):
+        clues = ' ; '.join(item['clues'][:clue_count])
+        lines.append(f"Mot {number} ({len(item['word'])} lettres) : {clues}\nRéponse : {item['word']}")
+    return '\n\n'.join(lines)
+
+
+def generate_local_content(task, rng=random):
+    """
+    Génère le contenu d'un jeu ; retourne None si le type n'est pas géré localement
+    ou si la banque n'a pas assez d'éléments pour cet âge (le fournisseur suivant prend le relais)
+    """
+    game_type = task.get('game_type')
+    if game_type not in LOCAL_GAME_TYPES:
+        return None
+    level, age, difficulty = task['level'], task['age'], task['difficulty']
+    if game_type == 'quiz':
+        return generate_quiz(level, age, difficulty, questions=task.get('questions'), rng=rng)
+    if game_type == 'memory':
+        return generate_memory(level, age, difficulty, rng=rng)
+    return generate_wordgame(level, age, difficulty, rng=rng)
+
+
+def local_provider_config():
+    """Entrée de la chaîne de fournisseurs pour le fournisseur local"""
+    return {
+        'name': 'local',
+        'local': True,
+        'generate': generate_local_content,
+    }
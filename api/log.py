@@ -0,0 +1,110 @@
+"""
+Logging structuré et non bloquant pour l'API
+
+Les enregistrements sont poussés dans une file en mémoire par le thread de la
+requête, puis formatés en JSON et écrits (fichier, console) par un thread dédié.
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+
+# Identifiant de la requête courante, propagé aux tâches asyncio via contextvars
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+# Champs `extra` repris tels quels dans les enregistrements JSON
+# (`game_level` et non `level`, réservé à la sévérité)
+STRUCTURED_FIELDS = (
+    'request_id', 'provider', 'game_type', 'game_level', 'age',
+    'latency_ms', 'status_code',
+)
+
+
+class RequestContextFilter(logging.Filter):
+    """Ajoute l'identifiant de requête courant à chaque enregistrement"""
+
+    def filter(self, record):
+        if getattr(record, 'request_id', None) is None:
+            record.request_id = request_id_var.get()
+        return True
+
+
+class SuccessSamplingFilter(logging.Filter):
+    """Ne conserve qu'une fraction des événements marqués `sampled` (succès à fort volume)"""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        if self.rate >= 1 or not getattr(record, 'sampled', False):
+            return True
+        return random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Formate un enregistrement en une ligne JSON"""
+
+    def format(self, record):
+        payload = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                payload[field] = value
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """
+    Handler asynchrone : le thread appelant ne fait qu'un `put_nowait`.
+    Le formatage et les écritures sont faits par un QueueListener.
+    Si la file est pleine, l'enregistrement est abandonné plutôt que de bloquer la requête.
+    """
+
+    def __init__(self, filename=None, console=True, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.dropped = 0
+        formatter = JsonFormatter()
+        targets = []
+        if filename:
+            file_handler = logging.FileHandler(filename, encoding='utf-8')
+            file_handler.setFormatter(formatter)
+            targets.append(file_handler)
+        if console:
+            console_handler = logging.StreamHandler(sys.stderr)
+            console_handler.setFormatter(formatter)
+            targets.append(console_handler)
+        self.listener = logging.handlers.QueueListener(self.queue, *targets, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def prepare(self, record):
+        # Pas de formatage dans le thread appelant : le message est résolu par le listener
+        return copy.copy(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        listener, self.listener = self.listener, None
+        if listener is not None:
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
+        super().close()
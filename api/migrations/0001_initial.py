@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameContent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('game_type', models.CharField(max_length=20)),
+                ('level', models.PositiveSmallIntegerField()),
+                ('age', models.PositiveSmallIntegerField()),
+                ('difficulty', models.CharField(max_length=20)),
+                ('content', models.TextField()),
+                ('signature', models.JSONField(help_text='Signature MinHash du texte normalisé')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['game_type', 'level', 'difficulty', 'age'], name='api_gamecon_game_ty_3f93eb_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ContentBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(db_index=True, max_length=40)),
+                ('content', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bands', to='api.gamecontent')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 11:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_throttlecounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gamecontent',
+            name='questions',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Nombre de questions (quiz)', null=True),
+        ),
+    ]
@@ -1,3 +1,32 @@
 from django.db import models
 
-# Create your models here.
+
+class GameContent(models.Model):
+    """Contenu de jeu généré, conservé pour la réutilisation entre paramètres voisins"""
+    game_type = models.CharField(max_length=20)
+    level = models.PositiveSmallIntegerField()
+    age = models.PositiveSmallIntegerField()
+    difficulty = models.CharField(max_length=20)
+    questions = models.PositiveSmallIntegerField(null=True, blank=True, help_text="Nombre de questions (quiz)")
+    content = models.TextField()
+    signature = models.JSONField(help_text="Signature MinHash du texte normalisé")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['game_type', 'level', 'difficulty', 'age'])]
+
+    def __str__(self):
+        return f"{self.game_type} niveau {self.level} ({self.age} ans)"
+
+
+class ContentBand(models.Model):
+    """Clé de bande LSH d'un contenu, utilisée pour trouver les candidats quasi-identiques"""
+    content = models.ForeignKey(GameContent, on_delete=models.CASCADE, related_name='bands')
+    key = models.CharField(max_length=40, db_index=True)
+
+
+class ThrottleCounter(models.Model):
+    """Compteur partagé du throttling (une ligne par client et par fenêtre)"""
+    key = models.CharField(max_length=200, unique=True)
+    count = models.BigIntegerField(default=0)
+    expires_at = models.DateTimeField(db_index=True)
@@ -0,0 +1,78 @@
+"""
+Mise en cache côté fournisseur du préambule stable des prompts
+
+Les prompts sont des `Prompt` : un préfixe stable par famille (consignes
+communes, modèle du type de jeu) suivi de la partie variable (niveau, âge...).
+OpenRouter reçoit le préfixe comme message système marqué `cache_control`.
+Gemini reçoit une référence `cachedContent` créée une fois par préfixe et
+réutilisée jusqu'à expiration ; si le préfixe est trop court pour le cache
+explicite, il est envoyé en `systemInstruction`, en tête de requête.
+"""
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from .budgets import estimate_tokens
+
+logger = logging.getLogger('api')
+
+
+class Prompt(str):
+    """Prompt complet (utilisable comme str) qui garde la séparation préfixe stable / partie variable"""
+
+    def __new__(cls, prefix, body):
+        prompt = super().__new__(cls, f"{prefix}\n\n{body}")
+        prompt.prefix = prefix
+        prompt.body = body
+        return prompt
+
+
+def cacheable_prefix(prompt):
+    """Préfixe stable du prompt, ou None si le cache de prompt est désactivé"""
+    if not settings.PROMPT_CACHE_ENABLED:
+        return None
+    return getattr(prompt, 'prefix', None)
+
+
+class GeminiContextCache:
+    """Noms des `cachedContents` Gemini par préfixe, avec leur date d'expiration"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    async def resolve(self, client, config, prefix):
+        """Retourne le nom du contenu en cache pour ce préfixe (créé si besoin), ou None"""
+        if estimate_tokens(prefix) < settings.GEMINI_CACHE_MIN_TOKENS:
+            return None
+        key = (config['model'], hashlib.sha256(prefix.encode()).hexdigest())
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry[1] > now:
+            return entry[0]
+
+        ttl = settings.PROMPT_CACHE_TTL
+        name = None
+        try:
+            response = await client.post(config['cache_url'], json={
+                'model': f"models/{config['model']}",
+                'systemInstruction': {'parts': [{'text': prefix}]},
+                'ttl': f"{ttl}s",
+            })
+            if response.status_code == 200:
+                name = response.json().get('name')
+            else:
+                logger.warning("Gemini context cache creation failed: %s", response.status_code, extra={'provider': config['name']})
+        except Exception as e:
+            logger.warning("Gemini context cache creation failed: %s", e, extra={'provider': config['name']})
+        with self._lock:
+            # Un échec est aussi mémorisé pour ne pas retenter à chaque appel
+            self._entries[key] = (name, now + ttl - 60 if name else now + ttl)
+        return name
+
+
+gemini_context_cache = GeminiContextCache()
@@ -0,0 +1,80 @@
+"""
+Appels aux fournisseurs LLM
+"""
+import logging
+
+import httpx
+from django.conf import settings
+
+from .admission import admission
+from .budgets import output_budgets
+from .cassettes import get_cassette_store, record, replay
+from .prompt_cache import cacheable_prefix
+from .tracing import span
+
+logger = logging.getLogger('api')
+
+
+async def _post(config, prompt, timeout, max_tokens=None):
+    """Appel HTTP réel ; retourne (status_code, contenu, tronqué)"""
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        prefix = cacheable_prefix(prompt)
+        cached_content = None
+        if prefix and config.get('context_cache'):
+            cached_content = await config['context_cache'].resolve(client, config, prefix)
+        body = config['body_builder'](prompt, max_tokens=max_tokens, cached_content=cached_content)
+        response = await client.post(config['url'], json=body, headers=config['headers'])
+    if response.status_code != 200:
+        return response.status_code, None, False
+    data = response.json()
+    return response.status_code, config['extractor'](data), config['truncated'](data)
+
+
+async def _call_remote(config, prompt, timeout, max_tokens, current):
+    store = get_cassette_store()
+    with admission.upstream_call():
+        if store is None:
+            return await _post(config, prompt, timeout, max_tokens)
+        if settings.LLM_CASSETTE_MODE == 'replay':
+            current.set(replayed=True)
+            return await replay(store, config, prompt)
+        return await record(store, config, prompt, lambda: _post(config, prompt, timeout, max_tokens))
+
+
+class GeneratedContent(str):
+    """Contenu généré (utilisable comme str) qui garde sa provenance"""
+
+    def __new__(cls, content, local=False):
+        generated = super().__new__(cls, content)
+        generated.local = local
+        return generated
+
+
+async def call_provider(config, prompt, timeout, task=None):
+    """
+    Envoie un prompt à un fournisseur et retourne (status_code, contenu ou None).
+    `task` décrit le jeu demandé (game_type, level, age, difficulty, questions) ;
+    il est utilisé par le fournisseur local, qui ne lit pas le prompt, et pour le
+    budget de tokens de sortie des fournisseurs distants (voir budgets.py).
+    En mode cassette, l'appel distant est enregistré ou rejoué (voir cassettes.py).
+    """
+    with span('provider', provider=config['name'], prompt_bytes=len(prompt.encode())) as current:
+        if config.get('local'):
+            content = config['generate'](task) if task else None
+            status_code = 200 if content else 501
+        else:
+            max_tokens = output_budgets.limit(task['game_type'], task['age'], task['difficulty']) if task else None
+            current.set(max_tokens=max_tokens)
+            status_code, content, truncated = await _call_remote(config, prompt, timeout, max_tokens, current)
+            if truncated and max_tokens:
+                # Sortie coupée par la limite : un nouvel essai avec un budget doublé (ou sans limite)
+                max_tokens = max_tokens * 2 if max_tokens * 2 <= settings.OUTPUT_BUDGET_MAX_TOKENS else None
+                current.set(truncated=True, retry_max_tokens=max_tokens)
+                logger.info("Output truncated by %s, retrying with %s tokens", config['name'], max_tokens, extra={'provider': config['name']})
+                status_code, content, truncated = await _call_remote(config, prompt, timeout, max_tokens, current)
+            if status_code == 200 and content and task and not truncated:
+                output_budgets.observe(task['game_type'], task['age'], task['difficulty'], content)
+        current.set(status_code=status_code, response_bytes=len(content.encode()) if content else 0)
+        if status_code != 200:
+            current.status = 'error'
+        return status_code, content
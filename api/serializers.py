@@ -1,6 +1,7 @@
 """
 Serializers pour la validation des données d'entrée
 """
+from django.conf import settings
 from rest_framework import serializers
 from .config import GAME_TYPES
 
@@ -27,6 +28,28 @@ class GenerateLevelContentSerializer(serializers.Serializer):
             raise serializers.ValidationError("Maximum 10 types de jeux par niveau.")
         return value
 
+class BatchLevelRequestSerializer(GenerateLevelContentSerializer):
+    id = serializers.CharField(
+        required=False,
+        max_length=64,
+        help_text="Clé de la sous-requête dans la réponse (par défaut sa position)"
+    )
+
+class BatchGenerateLevelContentSerializer(serializers.Serializer):
+    requests = BatchLevelRequestSerializer(many=True, allow_empty=False)
+    
+    def validate_requests(self, value):
+        if len(value) > settings.BATCH_MAX_REQUESTS:
+            raise serializers.ValidationError(f"Maximum {settings.BATCH_MAX_REQUESTS} niveaux par lot.")
+        ids = [item['id'] for item in value if 'id' in item]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError("Les identifiants de sous-requête doivent être uniques.")
+        # Une sous-requête sans id est rendue sous sa position : un id explicite ne doit pas la masquer
+        positions = {str(position) for position, item in enumerate(value) if 'id' not in item}
+        if positions & set(ids):
+            raise serializers.ValidationError("Un identifiant de sous-requête correspond à la position d'une sous-requête sans identifiant.")
+        return value
+
 class GameContentSerializer(serializers.Serializer):
     """Serializer pour la réponse de contenu de jeu"""
     type = serializers.CharField()
@@ -0,0 +1,144 @@
+"""
+Index de similarité (MinHash/LSH) sur le contenu de jeu généré
+
+Sert à détecter les quasi-doublons à l'insertion et à réutiliser un contenu
+généré pour des paramètres voisins (âge, niveau) au lieu d'appeler un LLM.
+"""
+import hashlib
+import logging
+import random
+import re
+import unicodedata
+
+from django.conf import settings
+
+from .models import GameContent, ContentBand
+
+logger = logging.getLogger('api')
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240717)  # graine fixe : les signatures stockées restent comparables
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+
+def normalize(text):
+    """Minuscules, sans accents ni ponctuation, espaces compactés"""
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    return re.sub(r'[^a-z0-9]+', ' ', text).strip()
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    words = normalize(text).split()
+    if len(words) <= size:
+        return {' '.join(words)}
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+def minhash(text):
+    hashes = [_hash64(s) for s in shingles(text)]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def similarity(signature_a, signature_b):
+    """Estimation de la similarité de Jaccard entre deux signatures"""
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / NUM_PERM
+
+
+def band_keys(game_type, signature):
+    keys = []
+    for band in range(BANDS):
+        rows = ','.join(map(str, signature[band * ROWS:(band + 1) * ROWS]))
+        keys.append(f"{game_type}:{band}:{hashlib.blake2b(rows.encode(), digest_size=8).hexdigest()}")
+    return keys
+
+
+def remove_near_duplicates(contents, threshold=None):
+    """Retire d'une liste de textes ceux qui sont quasi-identiques à un texte précédent"""
+    threshold = settings.CONTENT_DUPLICATE_THRESHOLD if threshold is None else threshold
+    kept, signatures = [], []
+    for text in contents:
+        signature = minhash(text)
+        if any(similarity(signature, other) >= threshold for other in signatures):
+            continue
+        kept.append(text)
+        signatures.append(signature)
+    return kept
+
+
+class ContentIndex:
+    """Accès à l'index persistant des contenus générés"""
+
+    def find_duplicate(self, game_type, signature):
+        candidates = GameContent.objects.filter(bands__key__in=band_keys(game_type, signature)).distinct()
+        for candidate in candidates:
+            if similarity(signature, candidate.signature) >= settings.CONTENT_DUPLICATE_THRESHOLD:
+                return candidate
+        return None
+
+    def add(self, game_type, level, age, difficulty, content, questions=None):
+        """Indexe un contenu ; retourne (entrée, est_un_doublon)"""
+        signature = minhash(content)
+        duplicate = self.find_duplicate(game_type, signature)
+        if duplicate is not None:
+            logger.info(
+                "Near-duplicate %s discarded (matches #%s)", game_type, duplicate.pk,
+                extra={'game_type': game_type, 'game_level': level, 'age': age},
+            )
+            return duplicate, True
+
+        entry = GameContent.objects.create(
+            game_type=game_type, level=level, age=age, difficulty=difficulty,
+            questions=questions, content=content, signature=signature,
+        )
+        ContentBand.objects.bulk_create(
+            ContentBand(content=entry, key=key) for key in band_keys(game_type, signature)
+        )
+        return entry, False
+
+    def compatible(self, game_type, level, age, difficulty, questions=None):
+        """Contenus générés pour des paramètres voisins, dans la tolérance configurée"""
+        age_tolerance = settings.CONTENT_REUSE_AGE_TOLERANCE
+        level_tolerance = settings.CONTENT_REUSE_LEVEL_TOLERANCE
+        contents = GameContent.objects.filter(
+            game_type=game_type,
+            difficulty=difficulty,
+            level__gte=level - level_tolerance,
+            level__lte=level + level_tolerance,
+            age__gte=age - age_tolerance,
+            age__lte=age + age_tolerance,
+        )
+        # Un quiz n'est servi qu'avec le nombre de questions prévu
+        if questions is not None:
+            contents = contents.filter(questions=questions)
+        return contents
+
+    def reuse(self, game_type, level, age, difficulty, questions=None, exclude=()):
+        """
+        Retourne un contenu existant à servir à la place d'une génération, ou None.
+        La réutilisation n'a lieu qu'avec un stock suffisant, et pour une fraction des
+        demandes, pour garder de la variété.
+        """
+        ratio = settings.CONTENT_REUSE_RATIO
+        if ratio <= 0 or random.random() >= ratio:
+            return None
+        pool = list(
+            self.compatible(game_type, level, age, difficulty, questions)
+            .exclude(pk__in=exclude)
+            .values_list('pk', flat=True)[:200]
+        )
+        if len(pool) < settings.CONTENT_REUSE_MIN_POOL:
+            return None
+        return GameContent.objects.get(pk=random.choice(pool))
+
+
+content_index = ContentIndex()
@@ -0,0 +1,127 @@
+"""
+Cache stale-while-revalidate des niveaux et structures générés
+
+Une entrée plus récente que la TTL souple est servie telle quelle. Entre la TTL
+souple et la TTL dure, elle est servie immédiatement et un seul rafraîchissement
+est lancé en arrière-plan (verrou par clé dans le cache partagé). Au-delà de la
+TTL dure, l'entrée a expiré et la génération est synchrone : une seule requête
+calcule, sous le même verrou, et les autres attendent son résultat.
+"""
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from .admission import ServiceOverloaded
+
+logger = logging.getLogger('api')
+
+FRESH = 'fresh'
+STALE = 'stale'
+MISS = 'miss'
+
+# Intervalle de relecture du cache pendant l'attente d'un calcul en cours (secondes)
+WAIT_INTERVAL = 0.1
+
+
+def _lock_key(key):
+    return f"{key}:refreshing"
+
+
+def cache_key(kind, *parts):
+    raw = ':'.join(str(p) for p in parts)
+    return f"theologix:{kind}:{hashlib.sha256(raw.encode()).hexdigest()[:32]}"
+
+
+def _spawn(target):
+    def run():
+        try:
+            target()
+        finally:
+            connections.close_all()
+    threading.Thread(target=run, daemon=True, name='swr-refresh').start()
+
+
+class StaleWhileRevalidate:
+    def __init__(self, spawn=_spawn):
+        self.spawn = spawn
+
+    def get(self, key, compute, cacheable=bool):
+        """
+        Retourne (valeur, état) où état vaut fresh, stale ou miss.
+        `compute()` produit une nouvelle valeur ; elle n'est stockée que si `cacheable(valeur)`.
+        """
+        if not settings.SWR_ENABLED:
+            return compute(), MISS
+        entry = cache.get(key)
+        if entry is not None:
+            age = time.time() - entry['created']
+            if age < settings.SWR_SOFT_TTL:
+                return entry['value'], FRESH
+            if age < settings.SWR_HARD_TTL:
+                self.refresh_in_background(key, compute, cacheable)
+                return entry['value'], STALE
+        return self._compute_once(key, compute, cacheable)
+
+    def _compute_once(self, key, compute, cacheable):
+        """
+        Calcul synchrone protégé par le verrou de la clé : les autres requêtes relisent
+        le cache jusqu'à SWR_WAIT_TIMEOUT, puis sont refusées (ServiceOverloaded).
+        """
+        deadline = time.monotonic() + settings.SWR_WAIT_TIMEOUT
+        while True:
+            if cache.add(_lock_key(key), True, timeout=settings.SWR_LOCK_TIMEOUT):
+                try:
+                    value = compute()
+                    self._store(key, value, cacheable)
+                    return value, MISS
+                finally:
+                    cache.delete(_lock_key(key))
+            if time.monotonic() >= deadline:
+                logger.warning("Gave up waiting for computation of %s", key)
+                raise ServiceOverloaded(wait=settings.ADMISSION_RETRY_AFTER)
+            time.sleep(WAIT_INTERVAL)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry['value'], FRESH
+
+    @staticmethod
+    def peek(key):
+        """État (fresh ou stale) d'une entrée encore servable, sans rafraîchissement ; None sinon"""
+        if not settings.SWR_ENABLED:
+            return None
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        age = time.time() - entry['created']
+        if age < settings.SWR_SOFT_TTL:
+            return FRESH
+        return STALE if age < settings.SWR_HARD_TTL else None
+
+    @staticmethod
+    def _store(key, value, cacheable):
+        if cacheable(value):
+            cache.set(key, {'value': value, 'created': time.time()}, timeout=settings.SWR_HARD_TTL)
+
+    def refresh_in_background(self, key, compute, cacheable):
+        lock = _lock_key(key)
+        # cache.add est atomique : un seul rafraîchissement par clé, même entre workers (Redis)
+        if not cache.add(lock, True, timeout=settings.SWR_LOCK_TIMEOUT):
+            return
+
+        def refresh():
+            try:
+                self._store(key, compute(), cacheable)
+            except Exception as e:
+                logger.warning("Background refresh failed for %s: %s", key, e)
+            finally:
+                cache.delete(lock)
+
+        self.spawn(refresh)
+
+
+swr_cache = StaleWhileRevalidate()
@@ -1,12 +1,40 @@
 """
 Tests unitaires pour l'API Theologix
 """
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
 from unittest.mock import patch, AsyncMock
-from .config import get_llm_configs, GAME_TYPES
+import asyncio
+import json
+import logging
+import tempfile
+import threading
+import time
+import httpx
+from .admission import admission, ServiceOverloaded
+from .budgets import OutputBudgets
+from .cassettes import CassetteStore
+from .config import get_llm_configs, get_provider_chain, get_game_prompt, GAME_TYPES
+from .local_provider import generate_quiz, generate_memory, generate_local_content, local_provider_config
+from .log import JsonFormatter, SuccessSamplingFilter
+from .models import GameContent, ThrottleCounter
+from .prompt_cache import GeminiContextCache
+from .providers import call_provider
+from .similarity import content_index, minhash, similarity, remove_near_duplicates
+from .swr import StaleWhileRevalidate
+from .throttling import DatabaseCounterBackend
+from .tracing import span, OTLPHttpExporter, JsonFileExporter
+from .views import get_difficulty
+
+class GenerationTestCase(APITestCase):
+    """Base des tests qui génèrent du contenu : le cache des niveaux est vidé entre les tests"""
+    
+    def setUp(self):
+        cache.clear()
 
 class ConfigTestCase(TestCase):
     """Tests pour la configuration"""
@@ -109,4 +137,632 @@ class ThrottlingTestCase(APITestCase):
         for i in range(5):
             response = self.client.get(url, {'levels': 1, 'age': 8})
             # En développement, le throttling peut ne pas être actif
-            self.assertIn(response.status_code, [status.HTTP_200_OK, status.HTTP_429_TOO_MANY_REQUESTS])
\ No newline at end of file
+            self.assertIn(response.status_code, [status.HTTP_200_OK, status.HTTP_429_TOO_MANY_REQUESTS])
+
+class StructuredLoggingTestCase(APITestCase):
+    """Tests pour le logging structuré"""
+    
+    def _record(self, **extra):
+        record = logging.LogRecord('api', logging.INFO, __file__, 1, "Content via %s", ('gemini',), None)
+        for key, value in extra.items():
+            setattr(record, key, value)
+        return record
+    
+    def test_json_formatter_includes_context(self):
+        """Le formateur JSON reprend le message et les champs structurés"""
+        line = JsonFormatter().format(self._record(request_id='abc', provider='gemini', latency_ms=12.5))
+        payload = json.loads(line)
+        self.assertEqual(payload['message'], 'Content via gemini')
+        self.assertEqual(payload['request_id'], 'abc')
+        self.assertEqual(payload['provider'], 'gemini')
+        self.assertEqual(payload['latency_ms'], 12.5)
+    
+    def test_json_formatter_keeps_severity(self):
+        """Le niveau de jeu ne remplace pas la sévérité"""
+        record = self._record(game_level=3, level=3)
+        record.levelno, record.levelname = logging.ERROR, 'ERROR'
+        payload = json.loads(JsonFormatter().format(record))
+        self.assertEqual(payload['level'], 'ERROR')
+        self.assertEqual(payload['game_level'], 3)
+    
+    def test_success_sampling(self):
+        """Seuls les événements échantillonnables sont filtrés"""
+        sampler = SuccessSamplingFilter(rate=0)
+        self.assertFalse(sampler.filter(self._record(sampled=True)))
+        self.assertTrue(sampler.filter(self._record()))
+    
+    def test_request_id_header(self):
+        """L'identifiant de requête est repris ou généré, puis renvoyé"""
+        url = reverse('bulk_generate')
+        response = self.client.get(url, {'levels': 'invalid'}, HTTP_X_REQUEST_ID='req-42')
+        self.assertEqual(response['X-Request-ID'], 'req-42')
+        response = self.client.get(url, {'levels': 'invalid'})
+        self.assertEqual(len(response['X-Request-ID']), 32)
+
+
+
+@override_settings(ADMISSION_CAPACITY=4, ADMISSION_RETRY_AFTER=12)
+class AdmissionControlTestCase(GenerationTestCase):
+    """Tests pour le contrôle d'admission"""
+    
+    def setUp(self):
+        super().setUp()
+        # Simule un processus déjà chargé
+        self.reserved = admission.try_reserve(4)
+    
+    def tearDown(self):
+        admission.release(self.reserved)
+    
+    def test_reserve_over_capacity(self):
+        """Une réservation au-delà de la capacité est refusée"""
+        self.assertIsNone(admission.try_reserve(1))
+        admission.release(self.reserved)
+        self.reserved = admission.try_reserve(100)
+        self.assertEqual(self.reserved, 4)
+    
+    def test_generate_level_content_rejected(self):
+        """Une requête refusée renvoie 503 avec Retry-After"""
+        response = self.client.get(reverse('generate_level_content'), {'level': 1, 'age': 8})
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '12')
+    
+    @patch('api.views.ask_llm_for_full_structure', AsyncMock(return_value=[]))
+    def test_bulk_with_content_reserves_one_slot(self):
+        """bulk_generate_with_content ne réserve que son unique appel en cours"""
+        admission.release(1)
+        self.reserved -= 1
+        response = self.client.get(reverse('bulk_generate_with_content'), {'levels': 10, 'age': 8})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(admission.snapshot()['reserved'], 3)
+    
+    def test_bulk_generate_degraded(self):
+        """La structure est planifiée localement quand le processus est saturé"""
+        response = self.client.get(reverse('bulk_generate'), {'levels': 3, 'age': 8})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Theologix-Degraded'], 'local-plan')
+        self.assertEqual([lvl['level'] for lvl in response.json()], [1, 2, 3])
+
+
+
+QUIZ_NOAH = (
+    "Question 1 : Qui a construit l'arche pour sauver les animaux du déluge ? "
+    "A) Noé B) Moïse C) David D) Abraham. Réponse : A. "
+    "Question 2 : Combien de jours a duré la pluie ? A) 7 B) 40 C) 12 D) 3. Réponse : B."
+)
+QUIZ_DAVID = (
+    "Question 1 : Quelle arme David a-t-il utilisée contre Goliath ? "
+    "A) Une épée B) Une fronde C) Un arc D) Une lance. Réponse : B. "
+    "Question 2 : Quel instrument jouait David pour le roi Saül ? A) La harpe B) La flûte. Réponse : A."
+)
+
+class SimilarityIndexTestCase(GenerationTestCase):
+    """Tests pour l'index de similarité"""
+    
+    def test_minhash_similarity(self):
+        """Deux variantes d'un même texte sont proches, deux textes différents non"""
+        variant = QUIZ_NOAH.replace("Qui a construit", "Qui a donc construit")
+        self.assertGreater(similarity(minhash(QUIZ_NOAH), minhash(variant)), 0.6)
+        self.assertLess(similarity(minhash(QUIZ_NOAH), minhash(QUIZ_DAVID)), 0.2)
+    
+    def test_near_duplicate_not_stored(self):
+        """Un quasi-doublon n'est pas inséré dans l'index"""
+        entry, duplicate = content_index.add('quiz', 1, 8, 'facile', QUIZ_NOAH)
+        self.assertFalse(duplicate)
+        same, duplicate = content_index.add('quiz', 1, 9, 'facile', QUIZ_NOAH.upper() + " !")
+        self.assertTrue(duplicate)
+        self.assertEqual(same.pk, entry.pk)
+        self.assertEqual(GameContent.objects.count(), 1)
+    
+    def test_remove_near_duplicates(self):
+        self.assertEqual(remove_near_duplicates([QUIZ_NOAH, QUIZ_DAVID, QUIZ_NOAH + "."]), [QUIZ_NOAH, QUIZ_DAVID])
+    
+    @override_settings(
+        CONTENT_REUSE_RATIO=1.0, CONTENT_REUSE_MIN_POOL=1, CONTENT_REUSE_AGE_TOLERANCE=1,
+        LOCAL_PROVIDER_ENABLED=False,
+    )
+    @patch('api.views.get_llm_configs')
+    def test_generate_level_content_reuses_neighbour_age(self, mock_get_configs):
+        """Le contenu généré pour 9 ans est servi à 8 ans sans appel LLM"""
+        mock_get_configs.return_value = []
+        content_index.add('wordgame', 1, 9, 'facile', "Trouve les mots bibliques : ARCHE, COLOMBE, ARC-EN-CIEL.")
+        response = self.client.get(reverse('generate_level_content'), {'level': 1, 'age': 8, 'game_types': ['wordgame']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['games']['wordgame']), 1)
+        
+        # Hors tolérance : aucun contenu réutilisable
+        response = self.client.get(reverse('generate_level_content'), {'level': 1, 'age': 5, 'game_types': ['wordgame']})
+        self.assertEqual(response.json()['games'], {})
+    
+    @override_settings(CONTENT_REUSE_RATIO=1.0, CONTENT_REUSE_MIN_POOL=1)
+    def test_quiz_reuse_matches_question_count(self):
+        """Un quiz n'est réutilisé que pour le nombre de questions prévu"""
+        entry, _ = content_index.add('quiz', 1, 8, 'facile', QUIZ_NOAH, questions=3)
+        self.assertIsNone(content_index.reuse('quiz', 1, 8, 'facile', questions=8))
+        self.assertEqual(content_index.reuse('quiz', 1, 8, 'facile', questions=3).pk, entry.pk)
+    
+    @override_settings(LOCAL_PROVIDER_ENABLED=True, CONTENT_REUSE_RATIO=0)
+    @patch('api.views.get_llm_configs')
+    def test_local_content_not_indexed(self, mock_get_configs):
+        """Le contenu du fournisseur local n'alimente pas l'index de réutilisation"""
+        mock_get_configs.return_value = []
+        response = self.client.get(reverse('generate_level_content'), {'level': 1, 'age': 8, 'game_types': ['memory', 'wordgame']})
+        self.assertEqual(sorted(response.json()['games']), ['memory', 'wordgame'])
+        self.assertEqual(GameContent.objects.count(), 0)
+
+
+
+class LocalProviderTestCase(GenerationTestCase):
+    """Tests pour le fournisseur local"""
+    
+    def test_quiz_from_bank(self):
+        """Le quiz local respecte le nombre de questions demandé"""
+        content = generate_quiz(level=2, age=8, difficulty='normal', questions=5)
+        self.assertEqual(content.count('Réponse :'), 5)
+    
+    def test_short_bank_falls_through(self):
+        """Une banque trop petite pour l'âge ne produit pas de contenu incomplet"""
+        self.assertIsNone(generate_quiz(level=1, age=3, difficulty='facile', questions=8))
+        self.assertIsNone(generate_memory(level=10, age=3, difficulty='facile'))
+        task = {'game_type': 'quiz', 'level': 1, 'age': 3, 'difficulty': 'facile', 'questions': 8}
+        self.assertEqual(asyncio.run(call_provider(local_provider_config(), 'prompt', timeout=1, task=task)), (501, None))
+    
+    def test_unsupported_game_type(self):
+        task = {'game_type': 'treasure', 'level': 1, 'age': 8, 'difficulty': 'facile'}
+        self.assertIsNone(generate_local_content(task))
+    
+    @override_settings(LOCAL_PROVIDER_ENABLED=True, LOCAL_PROVIDER_PRIMARY_MAX_LEVEL=1)
+    def test_provider_chain_order(self):
+        """Voie rapide aux premiers niveaux, dernier recours ensuite"""
+        remote = [{'name': 'gemini'}]
+        self.assertEqual([c['name'] for c in get_provider_chain(remote, 'quiz', 1)], ['local', 'gemini'])
+        self.assertEqual([c['name'] for c in get_provider_chain(remote, 'quiz', 3)], ['gemini', 'local'])
+        self.assertEqual([c['name'] for c in get_provider_chain(remote, 'story', 1)], ['gemini'])
+    
+    @override_settings(LOCAL_PROVIDER_ENABLED=True, CONTENT_REUSE_RATIO=0)
+    @patch('api.views.get_llm_configs')
+    def test_generate_level_content_falls_back_to_local(self, mock_get_configs):
+        """Sans fournisseur distant, les jeux simples sont générés localement"""
+        mock_get_configs.return_value = []
+        response = self.client.get(reverse('generate_level_content'), {'level': 1, 'age': 8, 'game_types': ['quiz', 'memory']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(response.json()['games']), ['memory', 'quiz'])
+
+
+
+class TracingTestCase(GenerationTestCase):
+    """Tests pour le traçage des requêtes"""
+    
+    @override_settings(TRACING_ENABLED=True, TRACING_DEBUG_ENDPOINT=True, CONTENT_REUSE_RATIO=0, LOCAL_PROVIDER_ENABLED=True)
+    @patch('api.views.get_llm_configs')
+    def test_spans_propagate_to_game_tasks(self, mock_get_configs):
+        """Les spans jeu et fournisseur sont rattachés à la trace de la requête"""
+        mock_get_configs.return_value = []
+        self.client.get(reverse('generate_level_content'), {'level': 1, 'age': 8, 'game_types': ['quiz', 'memory']}, HTTP_X_REQUEST_ID='trace-1')
+        
+        response = self.client.get(reverse('debug_traces'), {'limit': 100})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        trace = next(t for t in response.json() if t['spans'][0]['attributes'].get('request_id') == 'trace-1')
+        spans = {s['span_id']: s for s in trace['spans']}
+        games = [s for s in trace['spans'] if s['name'] == 'game']
+        providers = [s for s in trace['spans'] if s['name'] == 'provider']
+        self.assertEqual(len(games), 2)
+        self.assertEqual(len(providers), 2)
+        for provider in providers:
+            self.assertEqual(spans[provider['parent_id']]['name'], 'game')
+            self.assertGreater(provider['attributes']['response_bytes'], 0)
+    
+    @override_settings(TRACING_DEBUG_ENDPOINT=False)
+    def test_debug_endpoint_disabled(self):
+        response = self.client.get(reverse('debug_traces'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    @override_settings(TRACING_ENABLED=True, TRACING_EXPORTERS=[])
+    def test_otlp_payload(self):
+        """Conversion d'une trace au format OTLP/JSON"""
+        with patch('api.tracing.export') as mock_export:
+            with span('root'):
+                with span('child', provider='gemini'):
+                    pass
+        trace = mock_export.call_args[0][0]
+        payload = OTLPHttpExporter('http://collector:4318').to_otlp(trace)
+        otlp_spans = payload['resourceSpans'][0]['scopeSpans'][0]['spans']
+        self.assertEqual(len(otlp_spans), 2)
+        self.assertEqual(otlp_spans[1]['parentSpanId'], otlp_spans[0]['spanId'])
+        self.assertEqual(len(otlp_spans[0]['traceId']), 32)
+    
+    @override_settings(TRACING_ENABLED=True, TRACING_EXPORTERS=[])
+    def test_file_export_off_request_thread(self):
+        """L'écriture du fichier de traces est faite par le thread de l'exportateur"""
+        with tempfile.TemporaryDirectory() as tmp:
+            exporter = JsonFileExporter(f"{tmp}/traces.jsonl")
+            writers = []
+            write = exporter._write
+            exporter._write = lambda payload: (writers.append(threading.current_thread()), write(payload))
+            with patch('api.tracing.export', exporter.export):
+                with span('root'):
+                    pass
+            exporter._executor.shutdown(wait=True)
+            with open(f"{tmp}/traces.jsonl", encoding='utf-8') as f:
+                self.assertEqual(json.loads(f.readline())['name'], 'root')
+        self.assertNotEqual(writers, [threading.current_thread()])
+        self.assertEqual(len(writers), 1)
+
+
+
+class CassetteTestCase(APITestCase):
+    """Tests pour l'enregistrement / rejeu des fournisseurs"""
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+    
+    def test_lookup_by_normalized_prompt(self):
+        """Le prompt est retrouvé malgré les espaces et la casse, puis par sa forme"""
+        store = CassetteStore(self.tmp.name)
+        store.record('gemini', "Quiz de 5 questions\nniveau 2", 200, "contenu", 120.0)
+        self.assertEqual(CassetteStore(self.tmp.name).lookup('gemini', "quiz de 5  QUESTIONS niveau 2")['content'], "contenu")
+        self.assertEqual(store.lookup('gemini', "Quiz de 7 questions niveau 3")['content'], "contenu")
+        self.assertIsNone(store.lookup('gemini', "Autre prompt"))
+        self.assertIsNone(store.lookup('openrouter', "Quiz de 5 questions niveau 2"))
+    
+    def test_record_then_replay(self):
+        """Une réponse enregistrée est rejouée sans appel réseau"""
+        config = {'name': 'gemini', 'url': 'http://llm.invalid', 'headers': {},
+                  'body_builder': lambda prompt: {}, 'extractor': lambda resp: resp['text']}
+        with override_settings(LLM_CASSETTE_MODE='record', LLM_CASSETTE_DIR=self.tmp.name):
+            with patch('api.providers._post', AsyncMock(return_value=(200, "Réponse enregistrée", False))) as mock_post:
+                self.assertEqual(asyncio.run(call_provider(config, "Prompt", timeout=5)), (200, "Réponse enregistrée"))
+                mock_post.assert_awaited_once()
+        with override_settings(LLM_CASSETTE_MODE='replay', LLM_CASSETTE_DIR=self.tmp.name, LLM_CASSETTE_LATENCY_SCALE=0):
+            with patch('api.providers._post', AsyncMock()) as mock_post:
+                self.assertEqual(asyncio.run(call_provider(config, "prompt", timeout=5)), (200, "Réponse enregistrée"))
+                mock_post.assert_not_awaited()
+    
+    @override_settings(LLM_CASSETTE_MODE='replay', OPENROUTER_API_KEY='', GEMINI_API_KEY='')
+    def test_replay_without_keys(self):
+        """En rejeu, les fournisseurs restent dans la chaîne sans clé API"""
+        self.assertEqual([c['name'] for c in get_llm_configs()], ['openrouter', 'gemini'])
+
+
+@override_settings(CONTENT_REUSE_RATIO=0, BATCH_MAX_CONCURRENCY=2)
+class BatchGenerateTestCase(APITestCase):
+    """Tests pour la génération par lot"""
+    
+    def setUp(self):
+        self.active = 0
+        self.max_active = 0
+        self.calls = 0
+    
+    async def fake_fetch(self, game_type, level, age, difficulty, index=1, total=1, quiz_questions=None):
+        self.calls += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+        return f"Contenu {game_type} niveau {level} âge {age} jeu {index}"
+    
+    def test_batch_dedupes_and_shares_budget(self):
+        """Les sous-requêtes identiques sont générées une fois, sous un budget commun"""
+        payload = {'requests': [
+            {'id': 'alice', 'level': 1, 'age': 8, 'game_types': ['quiz', 'memory']},
+            {'id': 'bob', 'level': 1, 'age': 8, 'game_types': ['quiz', 'memory']},
+            {'level': 3, 'age': 10, 'game_types': ['story', 'wordgame', 'puzzle']},
+        ]}
+        with patch('api.views.fetch_llm_content', self.fake_fetch):
+            response = self.client.post(reverse('batch_generate_level_content'), payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual(sorted(results), ['2', 'alice', 'bob'])
+        self.assertEqual(results['alice'], results['bob'])
+        self.assertEqual(results['2']['level'], 3)
+        self.assertEqual(self.calls, 5)
+        self.assertEqual(self.max_active, 2)
+    
+    def test_batch_validation(self):
+        """Chaque sous-requête est validée comme generate_level_content"""
+        url = reverse('batch_generate_level_content')
+        response = self.client.post(url, {'requests': [{'level': 1}, {'age': 8}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('level', response.json()['requests'][1])
+        response = self.client.post(url, {'requests': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_batch_id_colliding_with_position(self):
+        """Un id explicite égal à la position d'une autre sous-requête est refusé"""
+        payload = {'requests': [{'level': 1, 'age': 8}, {'id': '0', 'level': 5, 'age': 8}]}
+        response = self.client.post(reverse('batch_generate_level_content'), payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('requests', response.json())
+
+
+
+@override_settings(
+    OUTPUT_BUDGET_ENABLED=True, OUTPUT_BUDGET_PERCENTILE=95, OUTPUT_BUDGET_HEADROOM=1.5,
+    OUTPUT_BUDGET_MIN_SAMPLES=20, OUTPUT_BUDGET_MAX_TOKENS=4096,
+)
+class OutputBudgetTestCase(APITestCase):
+    """Tests pour les budgets de tokens de sortie"""
+    
+    def test_limit_from_observations(self):
+        """Centile des tailles observées plus la marge, par groupe"""
+        budgets = OutputBudgets()
+        self.assertEqual(budgets.limit('memory', 8, 'facile'), 700)
+        for size in range(1, 101):
+            budgets.observe('memory', 7, 'facile', 'x' * (size * 4))
+        # 95e centile = 96 tokens estimés, x1.5
+        self.assertEqual(budgets.limit('memory', 8, 'facile'), 144)
+        self.assertEqual(budgets.limit('memory', 10, 'facile'), 700)
+    
+    @patch('django.conf.settings.OPENROUTER_API_KEY', 'test-key')
+    @patch('django.conf.settings.GEMINI_API_KEY', 'test-key')
+    def test_limit_applied_to_both_providers(self):
+        openrouter, gemini = get_llm_configs()
+        self.assertEqual(openrouter['body_builder']("p", max_tokens=300)['max_tokens'], 300)
+        self.assertEqual(gemini['body_builder']("p", max_tokens=300)['generationConfig'], {'maxOutputTokens': 300})
+        self.assertNotIn('max_tokens', openrouter['body_builder']("p"))
+        self.assertTrue(gemini['truncated']({'candidates': [{'finishReason': 'MAX_TOKENS'}]}))
+        self.assertTrue(openrouter['truncated']({'choices': [{'finish_reason': 'length'}]}))
+    
+    def test_truncated_output_retried_with_larger_budget(self):
+        config = {'name': 'gemini'}
+        task = {'game_type': 'story', 'level': 3, 'age': 9, 'difficulty': 'normal'}
+        post = AsyncMock(side_effect=[(200, "Il était une fois", True), (200, "Il était une fois... fin.", False)])
+        with patch('api.providers._post', post):
+            self.assertEqual(asyncio.run(call_provider(config, "Prompt", timeout=5, task=task)), (200, "Il était une fois... fin."))
+        self.assertEqual([c.args[3] for c in post.await_args_list], [1500, 3000])
+
+
+
+@override_settings(PROMPT_CACHE_ENABLED=True, PROMPT_CACHE_TTL=600, OUTPUT_BUDGET_ENABLED=False)
+@patch('django.conf.settings.OPENROUTER_API_KEY', 'test-key')
+@patch('django.conf.settings.GEMINI_API_KEY', 'test-key')
+class PromptCacheTestCase(APITestCase):
+    """Tests pour le cache du préambule des prompts, contre un serveur simulé"""
+    
+    def setUp(self):
+        self.requests = []
+        real_client = httpx.AsyncClient
+        
+        def handler(request):
+            self.requests.append(request)
+            if 'cachedContents' in request.url.path:
+                return httpx.Response(200, json={'name': 'cachedContents/quiz-preamble'})
+            if 'openrouter' in request.url.host:
+                return httpx.Response(200, json={'choices': [{'message': {'content': 'Contenu du quiz généré'}}]})
+            return httpx.Response(200, json={'candidates': [{'content': {'parts': [{'text': 'Contenu du quiz généré'}]}}]})
+        
+        transport = httpx.MockTransport(handler)
+        patcher = patch('api.providers.httpx.AsyncClient', lambda **kwargs: real_client(transport=transport, **kwargs))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def _bodies(self, path_part):
+        return [json.loads(r.content) for r in self.requests if path_part in r.url.path]
+    
+    def test_prompt_prefix_is_stable(self):
+        """Le préfixe ne dépend pas des paramètres du jeu"""
+        first = get_game_prompt('quiz', 1, 7, 'facile', questions=3)
+        second = get_game_prompt('quiz', 6, 12, 'difficile', questions=8)
+        self.assertEqual(first.prefix, second.prefix)
+        self.assertTrue(str(first).startswith(first.prefix))
+        self.assertNotIn('12', second.prefix)
+    
+    def test_gemini_reuses_cached_content(self):
+        """Le préfixe est mis en cache une fois, puis seule la partie variable est envoyée"""
+        gemini = get_llm_configs()[1]
+        gemini['context_cache'] = GeminiContextCache()
+        prompts = [get_game_prompt('quiz', level, 8, 'normal', questions=5) for level in (2, 3)]
+        with override_settings(GEMINI_CACHE_MIN_TOKENS=0):
+            for prompt in prompts:
+                asyncio.run(call_provider(gemini, prompt, timeout=5))
+        
+        self.assertEqual(len(self._bodies('cachedContents')), 1)
+        generate = self._bodies('generateContent')
+        self.assertEqual([b['cachedContent'] for b in generate], ['cachedContents/quiz-preamble'] * 2)
+        self.assertNotIn('systemInstruction', generate[0])
+        self.assertEqual(generate[1]['contents'][0]['parts'][0]['text'], prompts[1].body)
+        sent = sum(len(r.content) for r in self.requests if 'generateContent' in r.url.path)
+        self.assertLess(sent, sum(len(p.encode()) for p in prompts))
+    
+    def test_gemini_short_prefix_sent_first(self):
+        """Sous le seuil du cache explicite, le préfixe part en systemInstruction"""
+        gemini = get_llm_configs()[1]
+        gemini['context_cache'] = GeminiContextCache()
+        asyncio.run(call_provider(gemini, get_game_prompt('memory', 1, 6, 'facile'), timeout=5))
+        self.assertEqual(self._bodies('cachedContents'), [])
+        body = self._bodies('generateContent')[0]
+        self.assertIn('biblical memory game', body['systemInstruction']['parts'][0]['text'])
+    
+    def test_openrouter_cache_control(self):
+        openrouter = get_llm_configs()[0]
+        prompt = get_game_prompt('story', 4, 10, 'normal')
+        asyncio.run(call_provider(openrouter, prompt, timeout=5))
+        system, user = self._bodies('chat/completions')[0]['messages']
+        self.assertEqual(system['content'][0]['cache_control'], {'type': 'ephemeral'})
+        self.assertEqual(system['content'][0]['text'], prompt.prefix)
+        self.assertEqual(user['content'], prompt.body)
+
+
+
+@override_settings(SWR_ENABLED=True, SWR_SOFT_TTL=60, SWR_HARD_TTL=600, SWR_LOCK_TIMEOUT=30)
+class StaleWhileRevalidateTestCase(GenerationTestCase):
+    """Tests pour le cache stale-while-revalidate"""
+    
+    def setUp(self):
+        super().setUp()
+        self.spawned = []
+        self.swr = StaleWhileRevalidate(spawn=self.spawned.append)
+        self.generations = 0
+    
+    def compute(self):
+        self.generations += 1
+        return f"version {self.generations}"
+    
+    def test_fresh_stale_and_single_refresh(self):
+        with patch('api.swr.time.time', return_value=1000):
+            self.assertEqual(self.swr.get('k', self.compute), ('version 1', 'miss'))
+            self.assertEqual(self.swr.get('k', self.compute), ('version 1', 'fresh'))
+        
+        # Après la TTL souple : copie servie, un seul rafraîchissement pour plusieurs requêtes
+        with patch('api.swr.time.time', return_value=1100):
+            self.assertEqual(self.swr.get('k', self.compute), ('version 1', 'stale'))
+            self.assertEqual(self.swr.get('k', self.compute), ('version 1', 'stale'))
+            self.assertEqual(len(self.spawned), 1)
+            self.assertEqual(self.generations, 1)
+            self.spawned[0]()
+            self.assertEqual(self.swr.get('k', self.compute), ('version 2', 'fresh'))
+    
+    def test_hard_ttl_forces_synchronous_refresh(self):
+        with patch('api.swr.time.time', return_value=1000):
+            self.swr.get('k', self.compute)
+        cache.set('k', {'value': 'version 1', 'created': 1000})
+        with patch('api.swr.time.time', return_value=1000 + 601):
+            self.assertEqual(self.swr.get('k', self.compute), ('version 2', 'miss'))
+        self.assertEqual(self.spawned, [])
+    
+    def test_empty_results_not_cached(self):
+        self.swr.get('k', lambda: [])
+        self.assertEqual(self.swr.get('k', self.compute), ('version 1', 'miss'))
+    
+    def test_concurrent_miss_waits_for_single_computation(self):
+        """Pendant un calcul en cours, les autres requêtes attendent son résultat"""
+        cache.add('k:refreshing', True)
+        with patch('api.swr.time.sleep', side_effect=lambda _: cache.set('k', {'value': 'version 1', 'created': time.time()})):
+            self.assertEqual(self.swr.get('k', self.compute), ('version 1', 'fresh'))
+        self.assertEqual(self.generations, 0)
+    
+    @override_settings(SWR_WAIT_TIMEOUT=0)
+    def test_wait_timeout_is_overloaded(self):
+        cache.add('k:refreshing', True)
+        with self.assertRaises(ServiceOverloaded):
+            self.swr.get('k', self.compute)
+        self.assertEqual(self.generations, 0)
+    
+    @override_settings(CONTENT_REUSE_RATIO=0)
+    def test_partial_level_not_cached(self):
+        """Un niveau dont un jeu a échoué n'est pas mis en cache"""
+        async def fake_fetch(game_type, *args, **kwargs):
+            return None if game_type == 'story' else f"Contenu {game_type} pour le niveau"
+        with patch('api.views.fetch_llm_content', fake_fetch):
+            for _ in range(2):
+                response = self.client.get(reverse('generate_level_content'), {'level': 1, 'age': 8, 'game_types': ['quiz', 'story']})
+                self.assertEqual((sorted(response.json()['games']), response['X-Cache']), (['quiz'], 'miss'))
+    
+    @patch('api.views.get_llm_configs')
+    def test_bulk_generate_served_from_cache(self, mock_get_configs):
+        mock_get_configs.return_value = []
+        structure = [{'level': 1, 'difficulty': 'facile', 'games': [{'type': 'quiz'}]}]
+        with patch('api.views.ask_llm_for_full_structure', AsyncMock(return_value=structure)) as mock_ask:
+            first = self.client.get(reverse('bulk_generate'), {'levels': 1, 'age': 8})
+            second = self.client.get(reverse('bulk_generate'), {'levels': 1, 'age': 8})
+        self.assertEqual(mock_ask.await_count, 1)
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('miss', 'fresh'))
+        self.assertEqual(second.json(), structure)
+
+
+@override_settings(
+    REST_FRAMEWORK={'DEFAULT_THROTTLE_RATES': {'generation': '10/hour'}},
+    THROTTLE_BACKEND='database', LOCAL_PROVIDER_ENABLED=True, CONTENT_REUSE_RATIO=0,
+)
+class CostThrottleTestCase(GenerationTestCase):
+    """Tests pour le throttling pondéré par le coût"""
+    
+    def setUp(self):
+        super().setUp()
+        patcher = patch('api.views.get_llm_configs', return_value=[])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def level_content(self, game_types):
+        return self.client.get(reverse('generate_level_content'), {'level': 1, 'age': 8, 'game_types': game_types})
+    
+    def test_cost_per_game_type(self):
+        """Chaque type de jeu demandé compte pour un appel amont"""
+        for game_types in (['quiz', 'memory', 'wordgame', 'quiz'], ['memory', 'quiz', 'memory', 'wordgame']):
+            self.assertEqual(self.level_content(game_types).status_code, status.HTTP_200_OK)
+        response = self.level_content(['quiz', 'memory', 'wordgame'])
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+    
+    def test_rejected_request_is_refunded(self):
+        """Une requête refusée ne consomme pas le budget restant"""
+        self.assertEqual(self.level_content(['quiz'] * 8).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.level_content(['quiz', 'memory', 'wordgame']).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.level_content(['quiz', 'memory']).status_code, status.HTTP_200_OK)
+    
+    def test_batch_cost_counts_unique_requests(self):
+        item = {'level': 1, 'age': 8, 'game_types': ['quiz', 'memory']}
+        response = self.client.post(reverse('batch_generate_level_content'), {'requests': [item] * 4}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # 2 unités consommées sur 10
+        self.assertEqual(self.level_content(['quiz'] * 8).status_code, status.HTTP_200_OK)
+    
+    def test_cached_level_costs_one_unit(self):
+        """Un niveau servi depuis le cache SWR ne compte que pour une unité"""
+        with override_settings(SWR_ENABLED=True):
+            self.assertEqual(self.level_content(['quiz'] * 8).status_code, status.HTTP_200_OK)
+            response = self.level_content(['quiz'] * 8)
+            self.assertEqual((response.status_code, response['X-Cache']), (status.HTTP_200_OK, 'fresh'))
+            self.assertEqual(self.level_content(['memory']).status_code, status.HTTP_200_OK)
+            self.assertEqual(self.level_content(['memory']).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+    
+    @override_settings(SWR_ENABLED=False, CONTENT_REUSE_RATIO=1, CONTENT_REUSE_MIN_POOL=1)
+    def test_reused_content_is_refunded(self):
+        """Les jeux servis depuis l'index sont rendus après la réponse"""
+        for i in range(3):
+            content_index.add('memory', 1, 8, get_difficulty(1, 8), f"Paires mémoire {i} : " + ' '.join(f"mot{i}-{j}" for j in range(20)))
+        self.assertEqual(self.level_content(['memory', 'memory']).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.level_content(['quiz'] * 9).status_code, status.HTTP_200_OK)
+    
+    @override_settings(ADMISSION_CAPACITY=4)
+    def test_admission_refusal_is_refunded(self):
+        """Une requête refusée par le contrôle d'admission (503) ne consomme rien"""
+        reserved = admission.try_reserve(4)
+        try:
+            self.assertEqual(self.level_content(['quiz'] * 8).status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            response = self.client.get(reverse('bulk_generate_with_content'), {'levels': 1, 'age': 8})
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            response = self.client.post(
+                reverse('batch_generate_level_content'),
+                {'requests': [{'level': 1, 'age': 8, 'game_types': ['quiz'] * 8}]}, format='json',
+            )
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        finally:
+            admission.release(reserved)
+        self.assertEqual(ThrottleCounter.objects.get().count, 0)
+    
+    def test_database_counter_accumulates(self):
+        backend = DatabaseCounterBackend()
+        self.assertEqual(backend.charge('k', 3, 60), 3)
+        self.assertEqual(backend.charge('k', 4, 60), 7)
+        self.assertEqual(backend.charge('k', -4, 60), 3)
+
+
+class DatabaseCounterConcurrencyTestCase(TransactionTestCase):
+    """Incréments concurrents du compteur de throttling en base"""
+    
+    def setUp(self):
+        # Vérifié ici : la base de test n'existe pas encore à l'import du module
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("Nécessite une base de test partagée entre connexions")
+    
+    def test_overlapping_charges(self):
+        """Deux requêtes simultanées près de la limite : chacune voit son propre total"""
+        backend = DatabaseCounterBackend()
+        backend.charge('k', 9, 60)
+        barrier = threading.Barrier(2)
+        totals = []
+        
+        def charge():
+            try:
+                barrier.wait()
+                totals.append(backend.charge('k', 1, 60))
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=charge) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(totals), [10, 11])
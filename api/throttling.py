@@ -0,0 +1,121 @@
+"""
+Throttling pondéré par le coût amont des requêtes de génération
+
+Chaque requête est comptée pour le nombre d'appels LLM qu'elle peut déclencher
+(estimé par la vue), et non pour 1. Les compteurs vivent dans un stockage partagé
+à incrément atomique (cache Redis, ou base de données à défaut) pour que la
+limite tienne sur l'ensemble des workers.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+from .models import ThrottleCounter
+
+
+class CacheCounterBackend:
+    """Compteurs dans un cache Django (incr atomique avec Redis)"""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def charge(self, key, amount, timeout):
+        cache = caches[self.alias]
+        cache.add(key, 0, timeout)
+        try:
+            return cache.incr(key, amount)
+        except ValueError:
+            # Clé expirée entre add et incr
+            cache.add(key, amount, timeout)
+            return amount
+
+
+class DatabaseCounterBackend:
+    """Compteurs en base, incrémentés par UPDATE ... SET count = count + n"""
+
+    def charge(self, key, amount, timeout):
+        counters = ThrottleCounter.objects.filter(key=key)
+        # L'UPDATE verrouille la ligne jusqu'au commit : la relecture ne voit que notre incrément
+        with transaction.atomic():
+            if not counters.update(count=F('count') + amount):
+                now = timezone.now()
+                # Nouvelle fenêtre : on purge les compteurs expirés au passage
+                ThrottleCounter.objects.filter(expires_at__lt=now).delete()
+                try:
+                    with transaction.atomic():
+                        ThrottleCounter.objects.create(
+                            key=key, count=amount, expires_at=now + datetime.timedelta(seconds=timeout),
+                        )
+                except IntegrityError:
+                    counters.update(count=F('count') + amount)
+            return counters.select_for_update().values_list('count', flat=True).get()
+
+
+def get_counter_backend():
+    if settings.THROTTLE_BACKEND == 'cache':
+        return CacheCounterBackend(settings.THROTTLE_CACHE_ALIAS)
+    return DatabaseCounterBackend()
+
+
+def settle_upstream_cost(request, used):
+    """Rend la part du coût estimé qui n'a pas donné lieu à un appel amont (cache, réutilisation, refus)"""
+    charge = getattr(request, 'upstream_charge', None)
+    if charge is None:
+        return
+    request.upstream_charge = None
+    refund = charge['cost'] - min(used, charge['cost'])
+    if refund > 0:
+        charge['backend'].charge(charge['key'], -refund, charge['timeout'])
+
+
+class GenerationCostThrottle(SimpleRateThrottle):
+    """
+    Limite par IP exprimée en appels amont par période (taux `generation`).
+    La vue fournit le coût via `estimate_upstream_cost(request)`, puis rend
+    l'excédent avec `settle_upstream_cost(request, used)`.
+    """
+    scope = 'generation'
+
+    def get_rate(self):
+        # Lu à chaque instanciation pour suivre les changements de réglages
+        return api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+    @staticmethod
+    def get_cost(request, view):
+        estimate = getattr(view, 'estimate_upstream_cost', None)
+        return max(1, estimate(request)) if estimate else 1
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+
+        # Une requête seule plus coûteuse que la limite reste possible sur une fenêtre vide
+        cost = min(self.get_cost(request, view), self.num_requests)
+        self.now = self.timer()
+        window_start = int(self.now // self.duration * self.duration)
+        window_key = f"{key}:{window_start}"
+        backend = get_counter_backend()
+
+        if backend.charge(window_key, cost, self.duration) > self.num_requests:
+            # Requête refusée : son coût est rendu
+            backend.charge(window_key, -cost, self.duration)
+            self.wait_seconds = window_start + self.duration - self.now
+            return False
+        # Ajusté par la vue une fois les appels amont réellement faits connus
+        request.upstream_charge = {'backend': backend, 'key': window_key, 'cost': cost, 'timeout': self.duration}
+        return True
+
+    def wait(self):
+        return self.wait_seconds
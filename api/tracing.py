@@ -0,0 +1,241 @@
+"""
+Traçage léger des requêtes de génération
+
+Un span par requête, par jeu et par appel fournisseur. Le span courant est porté
+par un contextvar, donc propagé aux tâches créées par asyncio.gather. Quand le
+span racine se termine, la trace complète est envoyée aux exportateurs configurés.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger('api')
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    def __init__(self, name, trace, parent=None, attributes=None):
+        self.name = name
+        self.trace = trace
+        self.parent = parent
+        self.span_id = os.urandom(8).hex()
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter()
+        self.duration_ms = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self):
+        self.duration_ms = round((time.perf_counter() - self._started) * 1000, 1)
+
+    def to_dict(self):
+        return {
+            'span_id': self.span_id,
+            'parent_id': self.parent.span_id if self.parent else None,
+            'name': self.name,
+            'offset_ms': round((self.start_ns - self.trace.root.start_ns) / 1e6, 1),
+            'duration_ms': self.duration_ms,
+            'status': self.status,
+            'attributes': self.attributes,
+        }
+
+
+class Trace:
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.root = None
+        self.spans = []
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'name': self.root.name,
+            'duration_ms': self.root.duration_ms,
+            'status': self.root.status,
+            'start_ns': self.root.start_ns,
+            'spans': [s.to_dict() for s in self.spans],
+        }
+
+
+class _NoopSpan:
+    status = 'ok'
+
+    def set(self, **attributes):
+        pass
+
+
+@contextmanager
+def span(name, **attributes):
+    """Ouvre un span enfant du span courant (ou la racine d'une nouvelle trace)"""
+    parent = _current_span.get()
+    if parent is None and not settings.TRACING_ENABLED:
+        yield _NoopSpan()
+        return
+    trace = parent.trace if parent else Trace()
+    current = Span(name, trace, parent, attributes)
+    if parent is None:
+        trace.root = current
+    trace.spans.append(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = 'error'
+        current.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        current.finish()
+        _current_span.reset(token)
+        if parent is None:
+            export(trace)
+
+
+async def traced(name, coro, **attributes):
+    """Attend `coro` dans un span ; à utiliser autour des tâches passées à asyncio.gather"""
+    with span(name, **attributes) as current:
+        result = await coro
+        if not result:
+            current.status = 'empty'
+        elif isinstance(result, str):
+            current.set(response_bytes=len(result.encode()))
+        return result
+
+
+class RingBufferExporter:
+    """Garde les dernières traces en mémoire (consultées par l'endpoint de debug)"""
+
+    def __init__(self, size=200):
+        self.traces = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def export(self, trace):
+        with self._lock:
+            self.traces.append(trace.to_dict())
+
+    def slowest(self, limit=10):
+        with self._lock:
+            traces = list(self.traces)
+        return sorted(traces, key=lambda t: t['duration_ms'] or 0, reverse=True)[:limit]
+
+
+class JsonFileExporter:
+    """Ajoute chaque trace terminée en une ligne JSON dans un fichier, hors du chemin de requête"""
+
+    def __init__(self, path):
+        self.path = path
+        # Un seul worker : les écritures restent ordonnées, sans verrou côté requête
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='trace-file')
+        atexit.register(self._executor.shutdown, wait=True)
+
+    def _write(self, payload):
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(payload, ensure_ascii=False, default=str) + '\n')
+        except OSError as e:
+            logger.warning("Trace file export failed: %s", e)
+
+    def export(self, trace):
+        self._executor.submit(self._write, trace.to_dict())
+
+
+class OTLPHttpExporter:
+    """Envoie les traces au format OTLP/JSON (POST /v1/traces), hors du chemin de requête"""
+
+    def __init__(self, endpoint, service_name='theologix-backend'):
+        self.endpoint = endpoint.rstrip('/') + '/v1/traces'
+        self.service_name = service_name
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='otlp')
+        atexit.register(self._executor.shutdown, wait=True)
+
+    def to_otlp(self, trace):
+        spans = []
+        for s in trace.spans:
+            otlp_span = {
+                'traceId': trace.trace_id,
+                'spanId': s.span_id,
+                'name': s.name,
+                'startTimeUnixNano': str(s.start_ns),
+                'endTimeUnixNano': str(s.start_ns + int((s.duration_ms or 0) * 1e6)),
+                'attributes': [{'key': k, 'value': {'stringValue': str(v)}} for k, v in s.attributes.items()],
+                'status': {'code': 2 if s.status == 'error' else 1},
+            }
+            if s.parent:
+                otlp_span['parentSpanId'] = s.parent.span_id
+            spans.append(otlp_span)
+        return {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': self.service_name}}]},
+            'scopeSpans': [{'scope': {'name': 'api.tracing'}, 'spans': spans}],
+        }]}
+
+    def _send(self, payload):
+        try:
+            httpx.post(self.endpoint, json=payload, timeout=5)
+        except httpx.HTTPError as e:
+            logger.warning("OTLP export failed: %s", e)
+
+    def export(self, trace):
+        self._executor.submit(self._send, self.to_otlp(trace))
+
+
+ring_buffer = None
+_exporters = None
+
+
+def get_exporters():
+    global _exporters, ring_buffer
+    if _exporters is None:
+        exporters = []
+        for name in settings.TRACING_EXPORTERS:
+            if name == 'ring':
+                ring_buffer = RingBufferExporter(settings.TRACING_RING_SIZE)
+                exporters.append(ring_buffer)
+            elif name == 'file':
+                exporters.append(JsonFileExporter(settings.TRACING_FILE))
+            elif name == 'otlp' and settings.TRACING_OTLP_ENDPOINT:
+                exporters.append(OTLPHttpExporter(settings.TRACING_OTLP_ENDPOINT))
+        _exporters = exporters
+    return _exporters
+
+
+def slowest_traces(limit=10):
+    get_exporters()
+    return ring_buffer.slowest(limit) if ring_buffer else []
+
+
+def export(trace):
+    for exporter in get_exporters():
+        try:
+            exporter.export(trace)
+        except Exception as e:
+            logger.error("Trace export failed via %s: %s", type(exporter).__name__, e)
+
+
+class TracingMiddleware:
+    """Ouvre le span racine de chaque requête API"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.TRACING_ENABLED or not request.path.startswith('/api/') or request.path.startswith('/api/debug/'):
+            return self.get_response(request)
+        with span(f"{request.method} {request.path}", request_id=getattr(request, 'request_id', None)) as root:
+            response = self.get_response(request)
+            root.set(status_code=response.status_code)
+            if response.status_code >= 500:
+                root.status = 'error'
+        return response
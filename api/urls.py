@@ -3,6 +3,8 @@ from . import views
 
 urlpatterns = [
     path('generate_level_content/', views.GenerateLevelContentView.as_view(), name='generate_level_content'),
+    path('generate_level_content/batch/', views.BatchGenerateLevelContentView.as_view(), name='batch_generate_level_content'),
     path('bulk_generate/', views.BulkGenerateView.as_view(), name='bulk_generate'),
     path('bulk_generate_with_content/', views.BulkGenerateWithContentView.as_view(), name='bulk_generate_with_content'),
+    path('debug/traces/', views.SlowestTracesView.as_view(), name='debug_traces'),
 ]
@@ -2,7 +2,8 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.throttling import AnonRateThrottle
+from rest_framework.exceptions import NotFound
+from django.conf import settings
 
 import httpx
 import asyncio
@@ -10,15 +11,95 @@ import random
 import logging
 import json
 import re
+import time
 
-from .config import get_llm_configs, GAME_TYPES, get_game_prompt
-from .serializers import BulkGenerateSerializer, GenerateLevelContentSerializer
+from .admission import admission, ServiceOverloaded
+from .config import (
+    get_llm_configs, get_provider_chain, GAME_TYPES,
+    get_game_prompt, get_structure_prompt, get_game_content_prompt,
+)
+from .providers import call_provider, GeneratedContent
+from .serializers import BulkGenerateSerializer, GenerateLevelContentSerializer, BatchGenerateLevelContentSerializer
+from .similarity import content_index, remove_near_duplicates
+from .swr import swr_cache, cache_key, MISS
+from .throttling import GenerationCostThrottle, settle_upstream_cost
+from .tracing import traced, slowest_traces
 
 logger = logging.getLogger('api')
 
+# Nombre maximum de jeux générés par niveau dans bulk_generate_with_content
+MAX_GAMES_PER_LEVEL = 8
+
+def estimate_level_cost(level, game_types=None):
+    """Nombre maximal d'appels LLM pour un niveau (voir random_game_sequence)"""
+    return len(game_types) if game_types else min(6 + level, 10)
+
+def estimate_bulk_cost(levels):
+    """Structure + contenu de chaque jeu de chaque niveau"""
+    return 1 + levels * MAX_GAMES_PER_LEVEL
+
+def _elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 1)
+
+def get_difficulty(level, age):
+    if level <= 2:
+        return 'facile' if age < 10 else 'normal'
+    elif level <= 5:
+        return 'normal' if age < 12 else 'difficile'
+    else:
+        return 'difficile'
+
+def random_game_sequence(level, specific_types=None):
+    if specific_types:
+        return specific_types
+    
+    sequence = []
+    total_games = min(random.randint(4 + level, 6 + level), 10)  # Limite pour éviter timeouts
+    
+    if level == 1:
+        sequence += ['quiz'] * random.randint(2, 3)
+        sequence += ['wordgame'] * random.randint(1, 2)
+    elif level == 2:
+        sequence += ['quiz'] * random.randint(2, 3)
+        sequence += ['wordgame'] * random.randint(1, 2)
+        sequence += [random.choice(['story', 'memory'])]
+    else:
+        for _ in range(total_games):
+            sequence.append(random.choice(GAME_TYPES))
+    
+    random.shuffle(sequence)
+    # Évite les répétitions consécutives
+    for i in range(1, len(sequence)):
+        if sequence[i] == sequence[i-1]:
+            alt = [g for g in GAME_TYPES if g != sequence[i]]
+            if alt:
+                sequence[i] = random.choice(alt)
+    return sequence
+
+def plan_structure_locally(max_level, age):
+    """Structure de progression calculée sans LLM (mode dégradé)"""
+    structure = []
+    for level in range(1, max_level + 1):
+        games = []
+        for game in random_game_sequence(level):
+            entry = {'type': game}
+            if game == 'quiz':
+                entry['nombre_de_questions'] = random.randint(3, 8)
+            games.append(entry)
+        structure.append({'level': level, 'difficulty': get_difficulty(level, age), 'games': games})
+    return structure
+
+def run_async(coro):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
 async def fetch_llm_content(game_type, level, age, difficulty, index=1, total=1, quiz_questions=None):
     """Génère du contenu via LLM avec gestion d'erreurs et fallback"""
-    llm_configs = get_llm_configs()
+    llm_configs = get_provider_chain(get_llm_configs(), game_type, level)
     
     if not llm_configs:
         logger.error("No LLM configuration available")
@@ -30,35 +111,77 @@ async def fetch_llm_content(game_type, level, age, difficulty, index=1, total=1,
     else:
         prompt = get_game_prompt(game_type, level, age, difficulty)
     
-    logger.info(f"Generation {game_type} level {level} for age {age}")
+    task = {'game_type': game_type, 'level': level, 'age': age, 'difficulty': difficulty, 'questions': quiz_questions}
+    log_context = {'game_type': game_type, 'game_level': level, 'age': age}
+    logger.debug("Generation %s level %s for age %s", game_type, level, age, extra=log_context)
     
     for config in llm_configs:
+        provider_context = {**log_context, 'provider': config['name']}
+        started = time.perf_counter()
         try:
-            async with httpx.AsyncClient(timeout=20) as client:
-                body = config['body_builder'](prompt)
-                response = await client.post(config['url'], json=body, headers=config['headers'])
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    content = config['extractor'](data)
-                    
-                    if content and len(content.strip()) > 10:
-                        logger.info(f"Content generated successfully via {config['name']}")
-                        return content.strip()
-                else:
-                    logger.warning(f"API error {config['name']}: {response.status_code}")
-                    
+            status_code, content = await call_provider(config, prompt, timeout=20, task=task)
+            
+            if status_code == 200:
+                if content and len(content.strip()) > 10:
+                    logger.info(
+                        "Content generated successfully via %s", config['name'],
+                        extra={**provider_context, 'latency_ms': _elapsed_ms(started), 'sampled': True},
+                    )
+                    return GeneratedContent(content.strip(), local=bool(config.get('local')))
+            else:
+                logger.warning(
+                    "API error %s: %s", config['name'], status_code,
+                    extra={**provider_context, 'status_code': status_code, 'latency_ms': _elapsed_ms(started)},
+                )
+        
         except httpx.TimeoutException:
-            logger.warning(f"Timeout for {config['name']}")
+            logger.warning("Timeout for %s", config['name'], extra={**provider_context, 'latency_ms': _elapsed_ms(started)})
         except Exception as e:
-            logger.error(f"Error {config['name']}: {str(e)}")
+            logger.error("Error %s: %s", config['name'], e, extra={**provider_context, 'latency_ms': _elapsed_ms(started)})
             continue
     
-    logger.error(f"Failed to generate {game_type} level {level}")
+    logger.error("Failed to generate %s level %s", game_type, level, extra=log_context)
     return None
 
+async def ask_llm_for_full_structure(max_level, age):
+    """Demande au LLM la structure complète de la progression"""
+    llm_configs = get_llm_configs()
+    if not llm_configs:
+        return []
+    
+    prompt = get_structure_prompt(max_level, age)
+    
+    for config in llm_configs:
+        try:
+            status_code, content = await call_provider(config, prompt, timeout=30)
+            if status_code == 200 and content:
+                # Extraction robuste du JSON
+                match = re.search(r"```(?:json)?\s*([\s\S]+?)\s*```", content)
+                if match:
+                    content = match.group(1)
+                
+                if not content.strip().startswith('['):
+                    start = content.find('[')
+                    end = content.rfind(']')
+                    if start != -1 and end != -1:
+                        content = content[start:end+1]
+                
+                try:
+                    result = json.loads(content)
+                    logger.info("Structure generated successfully via %s", config['name'], extra={'provider': config['name'], 'sampled': True})
+                    return result
+                except json.JSONDecodeError:
+                    continue
+        except Exception as e:
+            logger.error("Error generating structure via %s: %s", config['name'], e, extra={'provider': config['name']})
+            continue
+    return []
+
 class BulkGenerateView(APIView):
-    throttle_classes = [AnonRateThrottle]
+    throttle_classes = [GenerationCostThrottle]
+    
+    def estimate_upstream_cost(self, request):
+        return 1
     
     def get(self, request):
         serializer = BulkGenerateSerializer(data=request.query_params)
@@ -67,61 +190,111 @@ class BulkGenerateView(APIView):
         
         max_level = serializer.validated_data['levels']
         age = serializer.validated_data['age']
+        
+        def compute():
+            with admission.admit(cost=1):
+                return run_async(traced('structure', ask_llm_for_full_structure(max_level, age), levels=max_level, age=age))
+        
+        try:
+            structure, cache_state = swr_cache.get(cache_key('structure', max_level, age), compute)
+        except ServiceOverloaded:
+            # Mode dégradé : la structure est planifiée localement plutôt que refusée
+            response = Response(plan_structure_locally(max_level, age))
+            response['X-Theologix-Degraded'] = 'local-plan'
+            return response
+        response = Response(structure)
+        response['X-Cache'] = cache_state
+        return response
 
-        async def ask_llm_for_full_structure():
-            llm_configs = get_llm_configs()
-            if not llm_configs:
-                return []
-                
-            prompt = (
-                "Tu es un game designer expert en jeux éducatifs bibliques pour enfants. "
-                f"Voici la liste des types de jeux disponibles : {', '.join(GAME_TYPES)}. "
-                f"L'utilisateur a {age} ans. Génère une progression complète de {max_level} niveaux, "
-                "où chaque niveau contient une alternance variée et logique de jeux, avec difficulté, nombre de jeux, nombre de questions pour les quiz, etc. "
-                "Adapte la structure à l'âge, propose des niveaux équilibrés, ludiques et progressifs. "
-                "Pour chaque niveau, donne un JSON structuré : level, difficulty, games (liste ordonnée d'objets avec type, consigne, nombre de questions si quiz, etc.). "
-                "N'invente pas de nouveaux types de jeux. Ne mets pas de fallback. Ne donne que la structure, pas le contenu des jeux."
-            )
-            
-            for config in llm_configs:
-                try:
-                    async with httpx.AsyncClient(timeout=30) as client:
-                        body = config['body_builder'](prompt)
-                        response = await client.post(config['url'], json=body, headers=config['headers'])
-                        if response.status_code == 200:
-                            data = response.json()
-                            content = config['extractor'](data)
-                            if content:
-                                # Extraction robuste du JSON
-                                match = re.search(r"```(?:json)?\s*([\s\S]+?)\s*```", content)
-                                if match:
-                                    content = match.group(1)
-                                
-                                if not content.strip().startswith('['):
-                                    start = content.find('[')
-                                    end = content.rfind(']')
-                                    if start != -1 and end != -1:
-                                        content = content[start:end+1]
-                                
-                                try:
-                                    result = json.loads(content)
-                                    logger.info(f"Structure generated successfully via {config['name']}")
-                                    return result
-                                except json.JSONDecodeError:
-                                    continue
-                except Exception as e:
-                    logger.error(f"Error generating structure via {config['name']}: {str(e)}")
-                    continue
-            return []
+def plan_level(level, age, specific_game_types=None):
+    """Choisit les jeux d'un niveau et sert depuis l'index ceux qui peuvent être réutilisés"""
+    difficulty = get_difficulty(level, age)
+    sequence = random_game_sequence(level, specific_game_types)
+    questions = {idx: random.randint(3, 8) for idx, game in enumerate(sequence) if game == 'quiz'}  # Réduit pour éviter timeouts
+    
+    # Contenu déjà généré pour des paramètres voisins : servi sans appel LLM
+    contents = {}
+    reused_ids = []
+    for idx, game in enumerate(sequence):
+        entry = content_index.reuse(game, level, age, difficulty, questions=questions.get(idx), exclude=reused_ids)
+        if entry is not None:
+            contents[idx] = entry.content
+            reused_ids.append(entry.pk)
+    
+    return {
+        'level': level,
+        'age': age,
+        'difficulty': difficulty,
+        'sequence': sequence,
+        'questions': questions,
+        'contents': contents,
+        'pending': [idx for idx in range(len(sequence)) if idx not in contents],
+    }
 
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        structure = loop.run_until_complete(ask_llm_for_full_structure())
-        loop.close()
-        return Response(structure)
+async def _bounded(semaphore, coro):
+    if semaphore is None:
+        return await coro
+    async with semaphore:
+        return await coro
+
+async def generate_pending_games(plan, semaphore=None):
+    """Génère les jeux non réutilisés d'un niveau ; `semaphore` borne la concurrence partagée"""
+    level, age, difficulty, sequence = plan['level'], plan['age'], plan['difficulty'], plan['sequence']
+    tasks = []
+    for idx in plan['pending']:
+        game = sequence[idx]
+        tasks.append(traced(
+            'game',
+            _bounded(semaphore, fetch_llm_content(
+                game, level, age, difficulty, idx+1, len(sequence), quiz_questions=plan['questions'].get(idx),
+            )),
+            game_type=game, level=level, index=idx+1,
+        ))
+    
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    generated = {}
+    
+    for idx, result in zip(plan['pending'], results):
+        game = sequence[idx]
+        if isinstance(result, Exception):
+            logger.error("Error generating %s: %s", game, result, extra={'game_type': game, 'game_level': level})
+        elif result:
+            generated[idx] = result
+    return generated
+
+def complete_level(plan, generated):
+    """Indexe le contenu généré et construit la réponse du niveau"""
+    sequence = plan['sequence']
+    for idx, result in generated.items():
+        # Le contenu du fournisseur local est regénérable à volonté : inutile de l'indexer
+        if getattr(result, 'local', False):
+            continue
+        content_index.add(sequence[idx], plan['level'], plan['age'], plan['difficulty'], result, questions=plan['questions'].get(idx))
+    contents = {**plan['contents'], **generated}
+    
+    games = {}
+    for idx in sorted(contents):
+        games.setdefault(sequence[idx], []).append(contents[idx])
+    # Deux jeux quasi-identiques dans un même niveau sont inutilisables
+    games = {g: remove_near_duplicates(items) for g, items in games.items()}
+    
+    return {'level': plan['level'], 'difficulty': plan['difficulty'], 'games': games}
+
+def level_cache_key(level, age, specific_game_types=None):
+    return cache_key('level', level, age, ','.join(specific_game_types or []))
 
 class GenerateLevelContentView(APIView):
-    throttle_classes = [AnonRateThrottle]
+    throttle_classes = [GenerationCostThrottle]
+    
+    def estimate_upstream_cost(self, request):
+        serializer = GenerateLevelContentSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return 1
+        data = serializer.validated_data
+        # Niveau servi depuis le cache : pas d'appel amont pendant la requête
+        if swr_cache.peek(level_cache_key(data['level'], data['age'], data.get('game_types'))):
+            return 1
+        return estimate_level_cost(data['level'], data.get('game_types'))
     
     def get(self, request):
         serializer = GenerateLevelContentSerializer(data=request.query_params)
@@ -131,83 +304,89 @@ class GenerateLevelContentView(APIView):
         level = serializer.validated_data['level']
         age = serializer.validated_data['age']
         specific_game_types = serializer.validated_data.get('game_types')
+        used = 0
+        complete = False
+        
+        def compute():
+            nonlocal used, complete
+            plan = plan_level(level, age, specific_game_types)
+            generated = {}
+            if plan['pending']:
+                with admission.admit(cost=len(plan['pending'])):
+                    used = len(plan['pending'])
+                    generated = run_async(generate_pending_games(plan))
+            # Seul un niveau dont tous les jeux prévus sont présents est mis en cache
+            complete = len(plan['contents']) + len(generated) == len(plan['sequence'])
+            return complete_level(plan, generated)
+        
+        key = level_cache_key(level, age, specific_game_types)
+        cache_state = None
+        try:
+            result, cache_state = swr_cache.get(key, compute, cacheable=lambda r: complete)
+        finally:
+            # Servi depuis le cache : une unité ; refusé (503) avant tout appel amont : rien
+            settle_upstream_cost(request, used if cache_state in (None, MISS) else 1)
+        response = Response(result)
+        response['X-Cache'] = cache_state
+        return response
 
-        def get_difficulty(level, age):
-            if level <= 2:
-                return 'facile' if age < 10 else 'normal'
-            elif level <= 5:
-                return 'normal' if age < 12 else 'difficile'
-            else:
-                return 'difficile'
-
-        def random_game_sequence(level, specific_types=None):
-            if specific_types:
-                return specific_types
-                
-            sequence = []
-            total_games = min(random.randint(4 + level, 6 + level), 10)  # Limite pour éviter timeouts
-            
-            if level == 1:
-                sequence += ['quiz'] * random.randint(2, 3)
-                sequence += ['wordgame'] * random.randint(1, 2)
-            elif level == 2:
-                sequence += ['quiz'] * random.randint(2, 3)
-                sequence += ['wordgame'] * random.randint(1, 2)
-                sequence += [random.choice(['story', 'memory'])]
-            else:
-                for _ in range(total_games):
-                    sequence.append(random.choice(GAME_TYPES))
-            
-            random.shuffle(sequence)
-            # Évite les répétitions consécutives
-            for i in range(1, len(sequence)):
-                if sequence[i] == sequence[i-1]:
-                    alt = [g for g in GAME_TYPES if g != sequence[i]]
-                    if alt:
-                        sequence[i] = random.choice(alt)
-            return sequence
-
-        difficulty = get_difficulty(level, age)
-        sequence = random_game_sequence(level, specific_game_types)
-        quiz_sizes = [random.randint(3, 8) for _ in sequence if _ == 'quiz']  # Réduit pour éviter timeouts
-        quiz_idx = 0
-
-        async def generate_level():
-            tasks = []
-            current_quiz_idx = 0
-            for idx, game in enumerate(sequence):
-                if game == 'quiz' and current_quiz_idx < len(quiz_sizes):
-                    qsize = quiz_sizes[current_quiz_idx]
-                    current_quiz_idx += 1
-                    tasks.append(fetch_llm_content(game, level, age, difficulty, idx+1, len(sequence), quiz_questions=qsize))
-                else:
-                    tasks.append(fetch_llm_content(game, level, age, difficulty, idx+1, len(sequence)))
-            
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            filtered = []
-            
-            for game, result in zip(sequence, results):
-                if isinstance(result, Exception):
-                    logger.error(f"Error generating {game}: {str(result)}")
-                elif result:
-                    filtered.append((game, result))
-            
-            games = {}
-            for g, r in filtered:
-                games.setdefault(g, []).append(r)
-            return games
-
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+class BatchGenerateLevelContentView(APIView):
+    throttle_classes = [GenerationCostThrottle]
+    
+    def estimate_upstream_cost(self, request):
+        serializer = BatchGenerateLevelContentSerializer(data=request.data)
+        if not serializer.is_valid():
+            return 1
+        # Les sous-requêtes identiques ne sont générées qu'une fois
+        unique = {
+            (item['level'], item['age'], tuple(item.get('game_types') or ())) for item in serializer.validated_data['requests']
+        }
+        return sum(estimate_level_cost(level, game_types) for level, _, game_types in unique)
+    
+    def post(self, request):
+        serializer = BatchGenerateLevelContentSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Les sous-requêtes identiques ne sont générées qu'une fois
+        keys = {}
+        plans = {}
+        for position, item in enumerate(serializer.validated_data['requests']):
+            game_types = item.get('game_types')
+            signature = (item['level'], item['age'], tuple(game_types) if game_types else None)
+            keys[item.get('id') or str(position)] = signature
+            if signature not in plans:
+                plans[signature] = plan_level(item['level'], item['age'], game_types)
+        
+        async def generate_batch():
+            # Un seul budget de concurrence pour tous les jeux du lot
+            semaphore = asyncio.Semaphore(settings.BATCH_MAX_CONCURRENCY)
+            signatures = list(plans)
+            results = await asyncio.gather(*(generate_pending_games(plans[sig], semaphore) for sig in signatures))
+            return dict(zip(signatures, results))
+        
+        generated = {signature: {} for signature in plans}
+        pending = sum(len(plan['pending']) for plan in plans.values())
+        used = 0
         try:
-            games = loop.run_until_complete(generate_level())
+            if pending:
+                with admission.admit(cost=pending):
+                    used = pending
+                    generated = run_async(generate_batch())
         finally:
-            loop.close()
-            
-        return Response({'level': level, 'difficulty': difficulty, 'games': games})
+            settle_upstream_cost(request, used)
+        
+        levels = {signature: complete_level(plan, generated[signature]) for signature, plan in plans.items()}
+        return Response({'results': {key: levels[signature] for key, signature in keys.items()}})
 
 class BulkGenerateWithContentView(APIView):
-    throttle_classes = [AnonRateThrottle]
+    throttle_classes = [GenerationCostThrottle]
+    
+    def estimate_upstream_cost(self, request):
+        serializer = BulkGenerateSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return 1
+        return estimate_bulk_cost(serializer.validated_data['levels'])
     
     def get(self, request):
         serializer = BulkGenerateSerializer(data=request.query_params)
@@ -216,99 +395,46 @@ class BulkGenerateWithContentView(APIView):
         
         max_level = serializer.validated_data['levels']
         age = serializer.validated_data['age']
-
-        async def ask_llm_for_full_structure():
-            llm_configs = get_llm_configs()
-            if not llm_configs:
-                return []
-                
-            prompt = (
-                "Tu es un game designer expert en jeux éducatifs bibliques pour enfants. "
-                f"Voici la liste des types de jeux disponibles : {', '.join(GAME_TYPES)}. "
-                f"L'utilisateur a {age} ans. Génère une progression complète de {max_level} niveaux, "
-                "où chaque niveau contient une alternance variée et logique de jeux, avec difficulté, nombre de jeux, nombre de questions pour les quiz, etc. "
-                "Adapte la structure à l'âge, propose des niveaux équilibrés, ludiques et progressifs. "
-                "Pour chaque niveau, donne un JSON structuré : level, difficulty, games (liste ordonnée d'objets avec type, consigne, nombre de questions si quiz, etc.). "
-                "N'invente pas de nouveaux types de jeux. Ne mets pas de fallback. Ne donne que la structure, pas le contenu des jeux."
-            )
-            
-            for config in llm_configs:
-                try:
-                    async with httpx.AsyncClient(timeout=30) as client:
-                        body = config['body_builder'](prompt)
-                        response = await client.post(config['url'], json=body, headers=config['headers'])
-                        if response.status_code == 200:
-                            data = response.json()
-                            content = config['extractor'](data)
-                            if content:
-                                match = re.search(r"```(?:json)?\s*([\s\S]+?)\s*```", content)
-                                if match:
-                                    content = match.group(1)
-                                if not content.strip().startswith('['):
-                                    start = content.find('[')
-                                    end = content.rfind(']')
-                                    if start != -1 and end != -1:
-                                        content = content[start:end+1]
-                                try:
-                                    result = json.loads(content)
-                                    logger.info(f"Complete structure generated via {config['name']}")
-                                    return result
-                                except json.JSONDecodeError:
-                                    continue
-                except Exception as e:
-                    logger.error(f"Error generating complete structure via {config['name']}: {str(e)}")
-                    continue
-            return []
-
+        
         async def fetch_content_for_game(game, level, age, difficulty):
-            llm_configs = get_llm_configs()
+            llm_configs = get_provider_chain(get_llm_configs(), game.get('type'), level)
             if not llm_configs:
                 return None
-                
+            
             # Compose un prompt contextuel pour chaque jeu
-            prompt = f"Tu es un assistant IA pour un jeu éducatif biblique. Génère le contenu complet pour ce jeu :\n"
-            prompt += f"- Type de jeu : {game.get('type')}\n"
-            if 'instruction' in game:
-                prompt += f"- Consigne : {game['instruction']}\n"
-            if 'consigne' in game:
-                prompt += f"- Consigne : {game['consigne']}\n"
-            if 'number_of_questions' in game:
-                prompt += f"- Nombre de questions : {game['number_of_questions']}\n"
-            if 'nombre_de_questions' in game:
-                prompt += f"- Nombre de questions : {game['nombre_de_questions']}\n"
-            if 'word_length' in game:
-                prompt += f"- Longueur des mots : {game['word_length']}\n"
-            if 'nombre_de_mots' in game:
-                prompt += f"- Nombre de mots : {game['nombre_de_mots']}\n"
-            if 'nombre_de_paires' in game:
-                prompt += f"- Nombre de paires : {game['nombre_de_paires']}\n"
-            if 'nombre_de_pièces' in game:
-                prompt += f"- Nombre de pièces : {game['nombre_de_pièces']}\n"
-            if 'nombre_d_indices' in game:
-                prompt += f"- Nombre d'indices : {game['nombre_d_indices']}\n"
-            prompt += f"- Niveau : {level}\n- Difficulté : {difficulty}\n- Âge utilisateur : {age}\n"
-            prompt += "Le contenu doit être original, adapté à l'âge, cohérent, et prêt à être utilisé dans le jeu. Réponds uniquement par le contenu, sans explication."
+            prompt = get_game_content_prompt(game, level, age, difficulty)
+            
+            questions = game.get('nombre_de_questions', game.get('number_of_questions'))
+            task = {
+                'game_type': game.get('type'),
+                'level': level if isinstance(level, int) else 1,
+                'age': age,
+                'difficulty': difficulty,
+                'questions': questions if isinstance(questions, int) else None,
+            }
             
             for config in llm_configs:
                 try:
-                    async with httpx.AsyncClient(timeout=30) as client:
-                        body = config['body_builder'](prompt)
-                        response = await client.post(config['url'], json=body, headers=config['headers'])
-                        if response.status_code == 200:
-                            data = response.json()
-                            content = config['extractor'](data)
-                            if content and len(content.strip()) > 10:
-                                return content.strip()
+                    status_code, content = await call_provider(config, prompt, timeout=30, task=task)
+                    if status_code == 200 and content and len(content.strip()) > 10:
+                        return content.strip()
                 except Exception as e:
-                    logger.error(f"Error generating game content via {config['name']}: {str(e)}")
+                    logger.error(
+                        "Error generating game content via %s: %s", config['name'], e,
+                        extra={'provider': config['name'], 'game_type': game.get('type'), 'game_level': level},
+                    )
                     continue
             return None
-
+        
+        upstream_calls = 0
+        
         async def generate_full():
-            structure = await ask_llm_for_full_structure()
+            nonlocal upstream_calls
+            upstream_calls += 1
+            structure = await traced('structure', ask_llm_for_full_structure(max_level, age), levels=max_level, age=age)
             if not structure:
                 return []
-                
+            
             # structure = [ {level, difficulty, games: [ ... ]}, ... ]
             for level_obj in structure:
                 level = level_obj.get('level')
@@ -316,20 +442,34 @@ class BulkGenerateWithContentView(APIView):
                 games = level_obj.get('games', [])
                 
                 # Limite le nombre de jeux pour éviter les timeouts
-                if len(games) > 8:
-                    games = games[:8]
+                if len(games) > MAX_GAMES_PER_LEVEL:
+                    games = games[:MAX_GAMES_PER_LEVEL]
                     level_obj['games'] = games
                 
                 # Pour compatibilité, accepter liste d'objets ou liste de dicts
                 for game in games:
-                    content = await fetch_content_for_game(game, level, age, difficulty)
+                    upstream_calls += 1
+                    content = await traced('game', fetch_content_for_game(game, level, age, difficulty), game_type=game.get('type'), level=level)
                     game['content'] = content
             return structure
-
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        
         try:
-            result = loop.run_until_complete(generate_full())
+            # Les jeux sont générés l'un après l'autre : un seul appel amont en cours à la fois
+            with admission.admit(cost=1):
+                result = run_async(generate_full())
         finally:
-            loop.close()
+            # Refusée (503) : aucun appel amont, rien n'est dû
+            settle_upstream_cost(request, upstream_calls)
         return Response(result)
+
+class SlowestTracesView(APIView):
+    """Traces récentes les plus lentes (debug)"""
+    
+    def get(self, request):
+        if not settings.TRACING_DEBUG_ENDPOINT:
+            raise NotFound()
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 100)
+        except ValueError:
+            return Response({'limit': ["Un entier est requis."]}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(slowest_traces(limit))
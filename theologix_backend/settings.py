@@ -44,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestIdMiddleware',
+    'api.tracing.TracingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -81,6 +83,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Base de test sur fichier : partagée entre connexions (tests de concurrence)
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -152,27 +156,95 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/hour',  # Limite pour éviter l'abus des API LLM
+        'generation': '1000/hour',  # Appels LLM estimés par IP (GenerationCostThrottle)
     }
 }
 
+# Stockage partagé des compteurs de throttling : 'database' (par défaut) ou 'cache' (Redis)
+THROTTLE_BACKEND = config('THROTTLE_BACKEND', default='database')
+THROTTLE_CACHE_ALIAS = 'default'
+
+# Admission control : nombre d'appels LLM acceptés (en cours + en attente) par processus
+ADMISSION_CAPACITY = config('ADMISSION_CAPACITY', default=60, cast=int)
+ADMISSION_RETRY_AFTER = config('ADMISSION_RETRY_AFTER', default=30, cast=int)  # secondes
+
+# Génération par lot (tableau de bord enseignant)
+BATCH_MAX_REQUESTS = config('BATCH_MAX_REQUESTS', default=30, cast=int)
+BATCH_MAX_CONCURRENCY = config('BATCH_MAX_CONCURRENCY', default=8, cast=int)  # jeux générés en parallèle par lot
+
+# Index de similarité du contenu généré
+CONTENT_DUPLICATE_THRESHOLD = config('CONTENT_DUPLICATE_THRESHOLD', default=0.8, cast=float)  # Jaccard estimé
+CONTENT_REUSE_AGE_TOLERANCE = config('CONTENT_REUSE_AGE_TOLERANCE', default=1, cast=int)
+CONTENT_REUSE_LEVEL_TOLERANCE = config('CONTENT_REUSE_LEVEL_TOLERANCE', default=0, cast=int)
+CONTENT_REUSE_RATIO = config('CONTENT_REUSE_RATIO', default=0.5, cast=float)  # part des jeux servis depuis l'index
+CONTENT_REUSE_MIN_POOL = config('CONTENT_REUSE_MIN_POOL', default=3, cast=int)
+
+# Fournisseur local (banque biblique embarquée) : dernier recours, ou voie rapide
+# pour quiz/memory/wordgame jusqu'au niveau LOCAL_PROVIDER_PRIMARY_MAX_LEVEL (0 = désactivé)
+LOCAL_PROVIDER_ENABLED = config('LOCAL_PROVIDER_ENABLED', default=True, cast=bool)
+LOCAL_PROVIDER_PRIMARY_MAX_LEVEL = config('LOCAL_PROVIDER_PRIMARY_MAX_LEVEL', default=0, cast=int)
+
+# Traçage des requêtes (exportateurs : ring, file, otlp)
+TRACING_ENABLED = config('TRACING_ENABLED', default=True, cast=bool)
+TRACING_EXPORTERS = config('TRACING_EXPORTERS', default='ring', cast=lambda v: [s.strip() for s in v.split(',') if s.strip()])
+TRACING_RING_SIZE = config('TRACING_RING_SIZE', default=200, cast=int)
+TRACING_FILE = config('TRACING_FILE', default=str(BASE_DIR / 'logs' / 'traces.jsonl'))
+TRACING_OTLP_ENDPOINT = config('TRACING_OTLP_ENDPOINT', default='')  # ex. http://localhost:4318
+TRACING_DEBUG_ENDPOINT = config('TRACING_DEBUG_ENDPOINT', default=DEBUG, cast=bool)
+
+# Enregistrement / rejeu des appels LLM pour les tests de charge (off, record, replay)
+LLM_CASSETTE_MODE = config('LLM_CASSETTE_MODE', default='off')
+LLM_CASSETTE_DIR = config('LLM_CASSETTE_DIR', default=str(BASE_DIR / 'cassettes'))
+LLM_CASSETTE_LATENCY_SCALE = config('LLM_CASSETTE_LATENCY_SCALE', default=1.0, cast=float)  # 0 = sans attente
+
+# Budgets de tokens de sortie : centile des tailles observées + marge, par type/âge/difficulté
+OUTPUT_BUDGET_ENABLED = config('OUTPUT_BUDGET_ENABLED', default=True, cast=bool)
+OUTPUT_BUDGET_PERCENTILE = config('OUTPUT_BUDGET_PERCENTILE', default=95, cast=float)
+OUTPUT_BUDGET_HEADROOM = config('OUTPUT_BUDGET_HEADROOM', default=1.25, cast=float)
+OUTPUT_BUDGET_MIN_SAMPLES = config('OUTPUT_BUDGET_MIN_SAMPLES', default=20, cast=int)
+OUTPUT_BUDGET_MAX_TOKENS = config('OUTPUT_BUDGET_MAX_TOKENS', default=4096, cast=int)
+
+# Cache de prompt côté fournisseur pour le préambule stable des prompts
+PROMPT_CACHE_ENABLED = config('PROMPT_CACHE_ENABLED', default=True, cast=bool)
+PROMPT_CACHE_TTL = config('PROMPT_CACHE_TTL', default=3600, cast=int)  # secondes
+# Taille minimale acceptée par le cache explicite Gemini ; en dessous, systemInstruction
+GEMINI_CACHE_MIN_TOKENS = config('GEMINI_CACHE_MIN_TOKENS', default=4096, cast=int)
+
+# Stale-while-revalidate des niveaux et structures générés (secondes)
+SWR_ENABLED = config('SWR_ENABLED', default=True, cast=bool)
+SWR_SOFT_TTL = config('SWR_SOFT_TTL', default=3600, cast=int)  # au-delà : servi + rafraîchi en arrière-plan
+SWR_HARD_TTL = config('SWR_HARD_TTL', default=86400, cast=int)  # au-delà : régénéré de façon synchrone
+SWR_LOCK_TIMEOUT = config('SWR_LOCK_TIMEOUT', default=120, cast=int)
+SWR_WAIT_TIMEOUT = config('SWR_WAIT_TIMEOUT', default=30, cast=int)  # attente du calcul d'une autre requête
+
 # Logging Configuration
+# Les logs passent par une file et sont écrits en JSON par un thread dédié
+LOG_SUCCESS_SAMPLE_RATE = config('LOG_SUCCESS_SAMPLE_RATE', default=1.0, cast=float)
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
-    'handlers': {
-        'file': {
-            'level': 'INFO',
-            'class': 'logging.FileHandler',
-            'filename': BASE_DIR / 'logs' / 'theologix.log',
+    'filters': {
+        'request_context': {
+            '()': 'api.log.RequestContextFilter',
         },
-        'console': {
+        'success_sampling': {
+            '()': 'api.log.SuccessSamplingFilter',
+            'rate': LOG_SUCCESS_SAMPLE_RATE,
+        },
+    },
+    'handlers': {
+        'async': {
             'level': 'DEBUG',
-            'class': 'logging.StreamHandler',
+            'class': 'api.log.AsyncQueueHandler',
+            'filename': BASE_DIR / 'logs' / 'theologix.log',
+            'console': True,
+            'filters': ['request_context', 'success_sampling'],
         },
     },
     'loggers': {
         'api': {
-            'handlers': ['file', 'console'],
+            'handlers': ['async'],
             'level': 'INFO',
             'propagate': True,
         },
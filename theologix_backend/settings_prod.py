@@ -26,11 +26,17 @@ CORS_ALLOWED_ORIGINS = config(
 # Rate limiting plus strict
 REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] = {
     'anon': '50/hour',  # Plus restrictif en production
+    'generation': '500/hour',
 }
 
 # Logging en production
-LOGGING['handlers']['file']['filename'] = '/var/log/theologix/theologix.log'
+LOGGING['handlers']['async']['filename'] = '/var/log/theologix/theologix.log'
 LOGGING['loggers']['api']['level'] = 'WARNING'  # Moins verbeux
+LOG_SUCCESS_SAMPLE_RATE = config('LOG_SUCCESS_SAMPLE_RATE', default=0.1, cast=float)
+LOGGING['filters']['success_sampling']['rate'] = LOG_SUCCESS_SAMPLE_RATE
+
+# Endpoint de debug des traces désactivé par défaut
+TRACING_DEBUG_ENDPOINT = config('TRACING_DEBUG_ENDPOINT', default=False, cast=bool)
 
 # Cache (optionnel avec Redis)
 if config('REDIS_URL', default=''):
@@ -43,6 +49,8 @@ if config('REDIS_URL', default=''):
             }
         }
     }
+    # Compteurs de throttling partagés entre workers (INCRBY atomique)
+    THROTTLE_BACKEND = config('THROTTLE_BACKEND', default='cache')
 
 # Database en production (optionnel)
 if config('DATABASE_URL', default=''):